@@ -1,11 +1,15 @@
 # distribution packages
+import heapq
 import numpy as np
 import pandas as pd
-import networkx as nx
 from tulip import tlp
 import tulipplugins
 import leidenalg
-import igraph
+from GraphSnapshot import GraphSnapshot, Adjacency
+from LeidenTrials import LeidenTrials
+from iGraphConverter import iGraphConverter
+from CommunityIndex import CommunityIndex
+from CommunityCohesion import CommunityCohesion
 
 """
 This script offers an alternative to Paquet-CLouston an Bouchard `python` package
@@ -17,136 +21,348 @@ computing their broker score defined on node sof a network. Please refer to thei
 
 Our code follows from the reformulation of Paquet-Clouston and Bouchard formula as a vector and matrix product.
 
-The main class `BrokerScore` implements all necessary methods, partly relying on the `Dijkstra` class
-to run a dfs and compute a community cohesion score. In order to stick with Paquet-Clouston and Bouchard definition
-of cohesion, we invoke networkX average path length routine which requires
-to convert from Tulip into the iGraph format.
+The main class `BrokerScore` implements all necessary methods, partly relying on the `ShortestPaths` class
+to run a bfs (or Dijkstra's algorithm) and compute a community cohesion score. In order to stick with Paquet-Clouston and Bouchard definition
+of cohesion, the average path length within each community is computed by the
+`CommunityCohesion` engine (breadth first searches over a CSR slice of the community).
+
+Communities found by each trial are held in memory (see `CommunityIndex`), the scores
+of a trial being computed by the `BrokerScoreTrial` class from arrays only.
 
 A code snippet at the bottom of the BrokerScore class file alows the use of the code
-from within the Tulip desktop applicaiton. Running the script should be easy. Make sure
-the local hierarchy is clean and does not contain any subgraph, as the script does produce
-a series of subgraph and makes use of unrobust naming conventions.
+from within the Tulip desktop applicaiton. Running the script should be easy. Communities
+of the last trial can optionally be exported as subgraphs: make sure the local hierarchy
+is then clean and does not contain any subgraph, as the export makes use of unrobust
+naming conventions.
 """
 
 
-class Dijkstra(object):
+class ShortestPaths(object):
     """
-    computes distances from a source using Dijkstra's algorithm
-    optionally displays shortest path between two node
+    computes distances from a source over the CSR (compressed sparse row)
+    adjacency of a graph snapshot (see GraphSnapshot): a bfs is used when edges have unit weights,
+    Dijkstra's algorithm (driven by a binary heap) when edge weights are given
 
-    the given graph is assumed to be connected
+    nodes are referred to by their position in the snapshot,
+    distances and parents are returned as numpy arrays indexed by these positions
+    (unreachable nodes get an infinite distance and a -1 parent)
     """
 
-    def __init__(self, graph):
+    def __init__(self, indptr, indices, weights=None):
+        """
+        neighbors of the node at position i are indices[indptr[i]:indptr[i + 1]],
+        weights (if any) are aligned with indices
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = None if weights is None else np.asarray(weights, dtype=float)
+        self.nb_nodes = len(self.indptr) - 1
+        if self.weights is not None:
+            # the heap loop runs in pure python, it is faster on plain lists
+            self._adjacency_ = (
+                self.indptr.tolist(),
+                self.indices.tolist(),
+                self.weights.tolist(),
+            )
+
+    @classmethod
+    def from_snapshot(cls, snapshot, weight_property=None):
         """
-        stores the graph
-        instantiates the necessary boolean properties
+        builds the engine over the (undirected) adjacency of a GraphSnapshot,
+        edge weights are optionally read from a double property
         """
-        self.graph = graph
-        self.source = None
-        self.dist_to_source = self.graph.getDoubleProperty("dist_to_source")
-        self.infinity = self.graph.numberOfNodes()
-        self.parent = {}
-        self.nodeList = [n for n in self.graph.getNodes()]
+        adjacency = snapshot.adjacency
+        weights = None
+        if weight_property is not None:
+            weight = snapshot.edge_column(weight_property, dtype=float)
+            weights = weight[adjacency.edges]
+        return cls(adjacency.indptr, adjacency.indices, weights)
+
+    @classmethod
+    def from_graph(cls, graph, weight_property=None):
+        """
+        snapshots a Tulip graph and builds the engine over it
+        returns the engine together with the list of nodes, in position order
+        """
+        snapshot = GraphSnapshot(graph)
+        return cls.from_snapshot(snapshot, weight_property), snapshot.nodes
 
     def compute_distance_from(self, source):
         """
-        distances from the given node are computed
+        distances from the node at position source are computed
+        returns the (distance, parent) pair of arrays
+        """
+        if self.weights is None:
+            return self._bfs_(source)
+        return self._dijkstra_(source)
+
+    def _bfs_(self, source):
+        # level synchronous bfs, each level is expanded at once
+        dist = np.full(self.nb_nodes, np.inf)
+        parent = np.full(self.nb_nodes, -1, dtype=np.int64)
+        dist[source] = 0.0
+        frontier = np.array([source], dtype=np.int64)
+        level = 0
+        while len(frontier) > 0:
+            level += 1
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            total = counts.sum()
+            if total == 0:
+                break
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            neighbors = self.indices[np.arange(total) + offsets]
+            parents = np.repeat(frontier, counts)
+            unseen = np.isinf(dist[neighbors])
+            # first occurrence of each newly reached node decides its parent
+            frontier, first = np.unique(neighbors[unseen], return_index=True)
+            dist[frontier] = level
+            parent[frontier] = parents[unseen][first]
+        return dist, parent
+
+    def _dijkstra_(self, source):
+        indptr, indices, weights = self._adjacency_
+        dist = [np.inf] * self.nb_nodes
+        parent = [-1] * self.nb_nodes
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                # stale entry, u has already been settled
+                continue
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                tmp_dist = d + weights[k]
+                if tmp_dist < dist[v]:
+                    dist[v] = tmp_dist
+                    parent[v] = u
+                    heapq.heappush(heap, (tmp_dist, v))
+        return np.array(dist), np.array(parent, dtype=np.int64)
+
+
+class BrokerScoreTrial(object):
+    """
+    computes the broker score of all nodes for one partition of the nodes
+    (one community detection trial)
+
+    the computation only relies on arrays (edge ends, CSR adjacency and community labels
+    indexed by node positions, see GraphSnapshot and CommunityIndex) so that
+    trials can run in worker processes
+    """
+
+    def __init__(self, labels, sources, targets, adjacency, cohesion=None):
+        """
+        cohesion is the CommunityCohesion engine computing average path lengths
+        within communities (exact, sequential computation by default)
+        """
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.sources = sources
+        self.targets = targets
+        self.adjacency = adjacency
+        self.nb_nodes = adjacency.nb_nodes
+        self.communities = CommunityIndex(self.labels, sources, targets)
+        self.nb_communities = self.communities.nb_communities
+        self.cohesion = CommunityCohesion() if cohesion is None else cohesion
+
+    def compute_cohesion_vector(self):
+        vec, self.cohesion_error = self.cohesion.compute(
+            self.communities, self.sources, self.targets, self.brokers
+        )
+        return vec
+
+    def compute_community_vector(self):
+        cohesion = self.compute_cohesion_vector()
+        # cohesion is 0 if a community reduces to a single node, its entry is then 1
+        vec = np.ones(self.nb_communities)
+        np.divide(self.communities.sizes, cohesion, out=vec, where=cohesion != 0)
+        return vec
+
+    def compute_community_adjacency(self):
+        """
+        builds, in one pass over the edges, the sparse node x community matrix
+        (in coordinate format) whose entry (u, C) is 1 if u belongs to C
+        or has a neighbor in C -- the rows of this matrix are the node vectors
+
+        brokers are those nodes whose row holds more than one entry
+        """
+        n = self.nb_nodes
+        rows = np.concatenate([np.arange(n), self.adjacency.owners()])
+        cols = np.concatenate([self.labels, self.labels[self.adjacency.indices]])
+        keys = np.unique(rows * self.nb_communities + cols)
+        self.community_adjacency = (
+            keys // self.nb_communities,
+            keys % self.nb_communities,
+        )
+        self.brokers = np.bincount(self.community_adjacency[0], minlength=n) > 1
+
+    def compute_neighbor_communities(self):
+        """
+        computes (the index of) neighbor communities to all nodes
+        given a node u, a neighbor community to that node is a community C
+        admitting a node v which is neighbor to u
+
+        a node u admitting at least one neighbor community (other than the one it belongs to)
+        is a broker
         """
-        for n in self.graph.getNodes():
-            self.dist_to_source[n] = self.infinity
-            self.parent[n] = None
-        self.dist_to_source[source] = 0.0
-
-        while len(self.nodeList) > 0:
-            u = self.__minNode__()
-            for v in self.graph.getInOutNodes(u):
-                tmp_dist = self.dist_to_source[u] + self.dist_between(u, v)
-                if tmp_dist < self.dist_to_source[v]:
-                    self.dist_to_source[v] = tmp_dist
-                    self.parent[v] = u
-
-    def __minNode__(self):
-        values = list(map(lambda x: self.dist_to_source[x], self.nodeList))
-        min_value = min(values)
-        min_node = self.nodeList.pop(values.index(min_value))
-        return min_node
-
-    def dist_between(self, u, v):
+        rows, cols = self.community_adjacency
+        other = cols != self.labels[rows]
+        self.neighbor_communities = [set() for u in range(self.nb_nodes)]
+        for u, c in zip(rows[other].tolist(), cols[other].tolist()):
+            self.neighbor_communities[u].add(c)
+
+    def compute_nbc_matrix(self):
         """
-        nodes u and v are assumed to be neighbor nodes
+        computes, in one pass over the nodes, the matrix whose entry (C, C')
+        is the number of nodes in community C having (at least one) a neighbor in C'
+
+        each node increments one counter per neighbor community, read from
+        the (node, community) pairs of the community adjacency
         """
-        return 1
+        rows, cols = self.community_adjacency
+        other = cols != self.labels[rows]
+        k = self.nb_communities
+        self.nbc = np.bincount(
+            self.labels[rows[other]] * k + cols[other], minlength=k * k
+        ).reshape(k, k)
+        return self.nbc
 
-class iGraphConverter:
+    def NBC(self, community_index, other_community_index):
+        """
+        computes the number of nodes in community
+        that have (at least one) a neighbor in other_community
+        """
+        return int(self.nbc[community_index, other_community_index])
+
+    def compute_community_matrix(self):
+        M = np.zeros(self.nbc.shape)
+        brokered = self.nbc != 0
+        M[brokered] = 1 / np.sqrt(self.nbc[brokered])
+        np.fill_diagonal(M, 1)
+        return M
+
+    def compute_node_vector(self, node_position):
+        # the community adjacency is sorted by node, the row of a node is a slice
+        rows, cols = self.community_adjacency
+        lo, hi = np.searchsorted(rows, [node_position, node_position + 1])
+        node_vector = np.zeros(self.nb_communities)
+        node_vector[cols[lo:hi]] = 1
+        return node_vector
+
+    def compute_broker_scores(self, C, M):
+        """
+        computes the broker score of all nodes at once,
+        the score of node u is the entry of (Delta_u * C) . M^T indexed by the community of u
+        """
+        rows, cols = self.community_adjacency
+        weights = C[cols] * M[self.labels[rows], cols]
+        scores = np.bincount(rows, weights=weights, minlength=self.nb_nodes)
+        scores[~self.brokers] = 0.0
+        return scores
+
+    def scores(self):
+        self.compute_community_adjacency()
+        self.compute_nbc_matrix()
+        C = self.compute_community_vector()
+        M = self.compute_community_matrix()
+        return self.compute_broker_scores(C, M)
+
+
+def broker_scores(membership, sources, targets, adjacency, cohesion=None):
+    """
+    per trial function run by the Leiden trials (possibly in worker processes)
+    """
+    return BrokerScoreTrial(membership, sources, targets, adjacency, cohesion).scores()
+
+
+class BrokerHierarchy(object):
     """
-    Utility class to convert graphs between formats,
-    baiscally Tulip and iGraph
-    (used by the iGrpah implementation of the Leiden algorithm)
+    computes the hierarchy of broker networks: level 0 is the whole graph and
+    level i + 1 is the network induced by brokers of level i (nodes with a positive score),
+    the construct is iterated until all nodes of a level are brokers (or none is)
+
+    levels are obtained by restricting the snapshot of the graph with node masks,
+    scores of each level being averaged over Leiden trials (see LeidenTrials)
     """
 
-    def __init__(self, tulip_graph):
-        super(iGraphConverter, self).__init__()
-        self.tulip_graph = tulip_graph
-        tulip_nodes = [n for n in self.tulip_graph.getNodes()]
-        tulip_edges = [e for e in self.tulip_graph.getEdges()]
-        self.node_to_index = {
-            tulip_nodes[i]: i for i in range(self.tulip_graph.numberOfNodes())
-        }
-        self.index_to_node = {
-            i: tulip_nodes[i] for i in range(self.tulip_graph.numberOfNodes())
-        }
-        self.edge_to_index = {e: self._edge_index_(e) for e in tulip_edges}
-        self.index_to_edge = {}
-        for tulip_edge, edge_index in self.edge_to_index.items():
-            self.index_to_edge[edge_index] = tulip_edge
-
-    def _edge_index_(self, tulip_edge):
-        s = self.tulip_graph.source(tulip_edge)
-        t = self.tulip_graph.target(tulip_edge)
-        i = self.node_to_index[s]
-        j = self.node_to_index[t]
-        return i * self.tulip_graph.numberOfNodes() + j
-
-    def to_igraph(self, exported_node_properties=[], exported_edge_properties=[]):
-        nb_vertices = self.tulip_graph.numberOfNodes()
-        edges = [
-            (
-                self.node_to_index[self.tulip_graph.source(e)],
-                self.node_to_index[self.tulip_graph.target(e)],
+    def __init__(
+        self,
+        snapshot,
+        nb_iterations=50,
+        nb_workers=1,
+        seed=None,
+        cohesion=None,
+        max_levels=None,
+    ):
+        self.snapshot = snapshot
+        self.nb_iterations = nb_iterations
+        self.nb_workers = nb_workers
+        self.seed = seed
+        self.cohesion = CommunityCohesion() if cohesion is None else cohesion
+        self.max_levels = max_levels
+
+    def level_scores(self, level, sources, targets, nb_nodes):
+        """
+        average broker scores of the network given by its edge ends,
+        together with the partition found by the last trial
+
+        nodes of levels above 0 are renumbered, their communities are thus cached
+        apart from those of the snapshot
+        """
+        cohesion = self.cohesion if level == 0 else self.cohesion.renumbered()
+        adjacency = Adjacency(
+            np.concatenate([sources, targets]),
+            np.concatenate([targets, sources]),
+            nb_nodes,
+        )
+        trials = LeidenTrials(
+            nb_nodes,
+            sources,
+            targets,
+            self.nb_workers,
+            None if self.seed is None else self.seed + level,
+        )
+        membership, scores, _ = trials.node_scores(
+            self.nb_iterations, broker_scores, (sources, targets, adjacency, cohesion)
+        )
+        return scores, membership
+
+    def compute(self, scores=None, membership=None):
+        """
+        returns the hierarchy as a table holding one row per node and level the node
+        belongs to (node position and id, level, community, broker score)
+
+        scores and communities of level 0 can be handed over when already computed
+        """
+        mask = np.ones(self.snapshot.nb_nodes, dtype=bool)
+        rows = []
+        level = 0
+        while True:
+            positions, sources, targets = self.snapshot.restrict(mask)
+            if level > 0 or scores is None:
+                scores, membership = self.level_scores(
+                    level, sources, targets, len(positions)
+                )
+            rows.append(
+                pd.DataFrame(
+                    {
+                        "position": positions,
+                        "node": self.snapshot.node_ids[positions],
+                        "level": level,
+                        "community": membership,
+                        "broker_score": scores,
+                    }
+                )
             )
-            for e in self.tulip_graph.getEdges()
-        ]
-        iG = igraph.Graph(nb_vertices)
-        iG = igraph.Graph.as_directed(iG, "random")
-        iG.add_edges(edges)
-        for p in exported_node_properties:
-            self.write_node_property(iG, p)
-        for p in exported_edge_properties:
-            self.write_edge_property(iG, p)
-        return iG
-
-    def write_node_property(self, i_graph, property_name):
-        values = []
-        # for i in range(self.tulip_graph.numberOfNodes():
-        # tulip_node_from_index = self.index_to_node[i]
-        # property_value = self.tulip_graph[property_name]
-        i_graph.vs[property_name] = [
-            self.tulip_graph[property_name][self.index_to_node[i]]
-            for i in range(self.tulip_graph.numberOfNodes())
-        ]
-
-    # edge in igraph, index of source and target in igraph, convert to unique integer
-    # use map integer -> edge in tulip graph
-    def write_edge_property(self, i_graph, property_name):
-        property_values = []
-        for e in i_graph.es:
-            i = e.source
-            j = e.target
-            edge_index = i * self.tulip_graph.numberOfNodes() + j
-            e_tulip = self.index_to_edge[edge_index]
-            property_values.append(self.tulip_graph[property_name][e_tulip])
-        i_graph.es[property_name] = property_values
+            brokers = scores > 0
+            level += 1
+            if brokers.all() or not brokers.any():
+                break
+            if self.max_levels is not None and level >= self.max_levels:
+                break
+            mask = np.zeros(self.snapshot.nb_nodes, dtype=bool)
+            mask[positions[brokers]] = True
+        return pd.concat(rows, ignore_index=True)
 
 
 class BrokerScore(tlp.DoubleAlgorithm):
@@ -176,6 +392,96 @@ class BrokerScore(tlp.DoubleAlgorithm):
             outParam=False,
             valuesDescription="Number of trials (community detection runs)",
         )
+        self.addIntegerParameter(
+            "nb workers",
+            help="Number of processes running the community detection trials (1 runs them within Tulip)",
+            defaultValue="1",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Number of worker processes",
+        )
+        self.addIntegerParameter(
+            "seed",
+            help="Seed from which the seeds of trials are derived (-1 for a random seed)",
+            defaultValue="-1",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Seed of the community detection trials",
+        )
+        self.addIntegerParameter(
+            "sampling threshold",
+            help="Cohesion of communities with more nodes is estimated from pivot sources (0 computes all cohesions exactly)",
+            defaultValue="0",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Size above which cohesion is estimated",
+        )
+        self.addIntegerParameter(
+            "nb pivots",
+            help="Number of sources used to estimate the cohesion of large communities (at least 2)",
+            defaultValue="100",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Number of pivot sources",
+        )
+        self.addIntegerParameter(
+            "cache size",
+            help="Number of community cohesions kept from one trial to the next (0 disables the cache)",
+            defaultValue="10000",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Size of the community cohesion cache",
+        )
+        self.addBooleanParameter(
+            "export communities",
+            help="Builds one subgraph per community found by the last trial",
+            defaultValue="False",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Export communities as subgraphs",
+        )
+        self.addBooleanParameter(
+            "trial statistics",
+            help="Stores the modularity, number of communities and timings of each trial as graph attributes (trial_modularity, trial_nb_communities, ...)",
+            defaultValue="False",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Collects statistics of trials",
+        )
+        self.addBooleanParameter(
+            "consensus",
+            help="Scores nodes once, on the consensus partition of trials (nodes linked by an edge falling within a community in most trials are kept together), the co-clustering frequency of edges is stored in the co_clustering property",
+            defaultValue="False",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Score nodes on the consensus partition",
+        )
+        self.addFloatParameter(
+            "consensus threshold",
+            help="Fraction of trials in which the ends of an edge must share a community for the edge to be kept in the consensus partition",
+            defaultValue="0.5",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Co-clustering threshold of the consensus partition",
+        )
+        self.addBooleanParameter(
+            "broker hierarchy",
+            help="Iterates the score on the network induced by brokers, the deepest level nodes reach is stored in the broker_level property",
+            defaultValue="False",
+            isMandatory=False,
+            inParam=True,
+            outParam=False,
+            valuesDescription="Compute the hierarchy of broker networks",
+        )
         self.addDoublePropertyParameter(
             "result",
             help="Double property holding the resulting coefficient",
@@ -196,16 +502,20 @@ class BrokerScore(tlp.DoubleAlgorithm):
         # algorithm can be applied and the second one can be used to provide
         # an error message.
 
-        # check whether communities have already been instanciated as subgraphs
+        # communities are only instanciated as subgraphs when exported,
+        # check whether they have already been
         # no fancy stuff here, if there are subgraphs assume everything works fine
         # no name checking or number of subgraphs etc.
         # its all or nothing
         test_community = len(list(self.graph.getSubGraphs())) > 0
-        if test_community:
+        if self.dataSet["export communities"] and test_community:
             return (
                 False,
                 "Make sure communities have not been computed as subgraphs already (delete all subgraphs).",
             )
+        # the error of a cohesion estimate needs the variance of at least 2 pivots
+        if self.dataSet["sampling threshold"] > 0 and self.dataSet["nb pivots"] < 2:
+            return (False, "At least 2 pivots are needed to estimate cohesion.")
         return (True, "")
 
     def _standardize_community_names_(self):
@@ -248,13 +558,7 @@ class BrokerScore(tlp.DoubleAlgorithm):
             communities = leidenalg.find_partition(
                 iG, leidenalg.ModularityVertexPartition
             )
-            membership = communities.membership
-            for n in self.graph.getNodes():
-                try:
-                    self.community[n] = membership[gc.node_to_index[n]]
-                except TypeError:
-                    print('Node to index')
-                    print(gc.node_to_index)
+            gc.write_membership(self.community, communities.membership)
 
     def collect_community_names(self):
         self.community_names = sorted(
@@ -269,25 +573,16 @@ class BrokerScore(tlp.DoubleAlgorithm):
                 return True
         return False
 
+    def _average_distance_(self, shortest_paths, source):
+        dist, _ = shortest_paths.compute_distance_from(source)
+        # unreachable nodes are assigned the number of nodes as distance
+        dist[np.isinf(dist)] = shortest_paths.nb_nodes
+        return dist.sum() / (shortest_paths.nb_nodes - 1)
+
     def compute_node_average_distance(self, subgraph, node):
         # computes the average distance to a node in a subgraph
-        dijk = Dijkstra(subgraph)
-        dijk.compute_distance_from(node)
-        result = subgraph.getDoubleProperty("dist_to_source")
-        ave = sum([result[n] for n in subgraph.getNodes()]) / (
-            subgraph.numberOfNodes() - 1
-        )
-        return ave
-
-    def compute_community_cohesion(self, community_name):
-        subgraph = self.graph.getSubGraph(community_name)
-        G = nx.Graph()
-        for n in subgraph.getNodes():
-            G.add_node(n.id)
-        for e in subgraph.getEdges():
-            G.add_edge(subgraph.source(e).id, subgraph.target(e).id)
-        cohesion = nx.average_shortest_path_length(G)
-        return cohesion
+        shortest_paths, nodes = ShortestPaths.from_graph(subgraph)
+        return self._average_distance_(shortest_paths, nodes.index(node))
 
     def compute_community_cohesion_old(self, community_name):
         """
@@ -296,95 +591,14 @@ class BrokerScore(tlp.DoubleAlgorithm):
         average these average distance for all nodes
         """
         community_subgraph = self.graph.getSubGraph(community_name)
-        average_distance_to_node = {}
-        for node in community_subgraph.getNodes():
-            average_distance_to_node[node] = self.compute_node_average_distance(
-                community_subgraph, node
-            )
-        cohesion = (
-            sum([average_distance_to_node[n] for n in community_subgraph.getNodes()])
-            / community_subgraph.numberOfNodes()
+        # the adjacency snapshot is built once and shared by all sources
+        shortest_paths, nodes = ShortestPaths.from_graph(community_subgraph)
+        average_distance_to_node = np.array(
+            [self._average_distance_(shortest_paths, i) for i in range(len(nodes))]
         )
+        cohesion = average_distance_to_node.sum() / len(nodes)
         return cohesion
 
-    def compute_cohesion_vector(self):
-        vec = np.zeros(self.nb_communities)
-        for i, c in enumerate(self.community_names):
-            vec[i] = self.compute_community_cohesion(c)
-        return vec
-
-    def compute_community_vector(self):
-        vec = np.zeros(self.nb_communities)
-        for i, c in enumerate(self.community_names):
-            community_size = self.graph.getSubGraph(c).numberOfNodes()
-            comm_cohesion = self.compute_community_cohesion(c)
-            try:
-                vec[i] = community_size / comm_cohesion
-            except ZeroDivisionError:
-                # happens if a community reduces to a single node
-                vec[i] = 1
-        return vec
-
-    def compute_neighbor_communities(self):
-        """
-        computes (the index of) neighbor communities to all nodes and store
-        that information in a map
-        given a node u, a neighbor community to that node is a community C
-        admitting a node v which is neighbor to u
-
-        a node u admitting at least one neighbor community (other than the one it belongs to)
-        is a broker
-        """
-        self.neighbor_communities = {}
-        for node in self.graph.getNodes():
-            neighCommunities = set(
-                [int(self.community[neigh]) for neigh in self.graph.getInOutNodes(node)]
-            )
-            try:
-                neighCommunities.remove(int(self.community[node]))
-            except KeyError:
-                # remove will fail if node has no neighbor in its own community
-                # happens if a community contains only one node
-                # (happeded with broker's network)
-                pass
-            self.graph["neighbor_communities"][node] = [
-                str(x) for x in neighCommunities
-            ]
-            self.neighbor_communities[node] = neighCommunities
-
-    def NBC(self, community_index, other_community_index):
-        """
-        computes the number of nodes in community
-        that have (at least one) a neighbor in other_community
-        """
-        community_name = self.community_names[community_index]
-        community_subgraph = self.graph.getSubGraph(community_name)
-        n_brokers = 0
-        for n in community_subgraph.getNodes():
-            if other_community_index in self.neighbor_communities[n]:
-                n_brokers += 1
-        return n_brokers
-
-    def compute_community_matrix(self):
-        M = np.zeros((self.nb_communities, self.nb_communities))
-        for i, c in enumerate(self.community_names):
-            for j, cc in enumerate(self.community_names):
-                if i == j:
-                    M[i, j] = 1
-                else:
-                    nbc = self.NBC(i, j)
-                    if nbc != 0:
-                        M[i, j] = 1 / np.sqrt(nbc)
-        return M
-
-    def compute_node_vector(self, node):
-        node_vector = np.zeros(self.nb_communities)
-        node_vector[int(self.community[node])] = 1
-        if len(self.neighbor_communities[node]) > 0:
-            for i in self.neighbor_communities[node]:
-                node_vector[i] = 1
-        return node_vector
-
     def number_of_brokers(self):
         return sum(
             [
@@ -393,44 +607,27 @@ class BrokerScore(tlp.DoubleAlgorithm):
             ]
         )
 
-    def compute_broker_network(self):
-        i = 0
-        current_graph = self.graph
-        community_property_name = f"community_{i}"
-        score_property_name = f"broker_score_{i}"
-        selection_property_name = f"is_broker_{i}"
-        # level 0 coincides with original graph
-        community_0 = current_graph.getLocalDoubleProperty(community_property_name)
-        try:
-            community_0.copy(self.community)
-        except TypeError:
-            for n in current_graph.getNodes():
-                self.community[n] = int(community_0[n])
-
-        while True:
-            bs = BrokerScore(
-                current_graph, community_property_name, score_property_name
-            )
-            bs.node_brokerage_score()
-            select = current_graph.getBooleanProperty(selection_property_name)
-            select.setAllNodeValue(False)
-            score = current_graph.getLocalDoubleProperty(score_property_name)
-            for n in current_graph.getNodes():
-                if score[n] > 0:
-                    select[n] = True
-            induced_subgraph = current_graph.inducedSubGraph(
-                select, name=selection_property_name
-            )
-            if induced_subgraph.numberOfNodes() == current_graph.numberOfNodes():
-                # all nodes in current_graph are brokers
-                current_graph.delSubGraph(induced_subgraph)
-                return
-            else:
-                i += 1
-                community_property_name = f"community_{i}"
-                score_property_name = f"broker_score_{i}"
-                selection_property_name = f"is_broker_{i}"
-                current_graph = induced_subgraph
+    def compute_broker_network(self, scores, membership, nb_iterations, cohesion):
+        """
+        computes the hierarchy of broker networks (see BrokerHierarchy) starting from
+        the scores computed on the whole graph, the deepest level each node
+        belongs to is stored in the broker_level property
+        """
+        seed = self.dataSet["seed"]
+        hierarchy = BrokerHierarchy(
+            self.snapshot,
+            nb_iterations,
+            self.dataSet["nb workers"],
+            None if seed < 0 else seed,
+            cohesion,
+        )
+        table = hierarchy.compute(scores, membership)
+        broker_level = np.zeros(self.snapshot.nb_nodes, dtype=np.int64)
+        np.maximum.at(broker_level, table["position"], table["level"])
+        self.snapshot.write_node_values(
+            self.graph.getIntegerProperty("broker_level"), broker_level
+        )
+        return table
 
     def run(self):
         # This method is the entry point of the algorithm when it is called
@@ -451,33 +648,58 @@ class BrokerScore(tlp.DoubleAlgorithm):
         self.community = self.dataSet["communities"]
         nb_iterations = self.dataSet["nb iterations"]
         broker_score = self.dataSet["result"]
-        broker_score.setAllNodeValue(0.0)
-
-        for k in range(nb_iterations):
-            self.run_community_finding_algorithm()
-            self.nb_communities = int(self.community.getNodeMax() + 1)
+        nb_workers = self.dataSet["nb workers"]
+        seed = self.dataSet["seed"]
+        self.snapshot = GraphSnapshot(self.graph)
+
+        # trials (Leiden run and scores) are dispatched to worker processes
+        # when asked to, edge ends and adjacency are shipped once to each of them
+        trials = LeidenTrials.from_snapshot(
+            self.snapshot,
+            nb_workers,
+            None if seed < 0 else seed,
+            self.dataSet["trial statistics"],
+        )
+        # communities are processed in parallel when trials are not,
+        # their cohesion is cached by each process running trials
+        cohesion = CommunityCohesion(
+            nb_workers,
+            self.dataSet["sampling threshold"],
+            self.dataSet["nb pivots"],
+            None if seed < 0 else seed,
+            self.dataSet["cache size"],
+        )
+        trial_arguments = (
+            self.snapshot.sources,
+            self.snapshot.targets,
+            self.snapshot.adjacency,
+            cohesion,
+        )
+        # scores are averaged over trials, or in consensus mode, computed once
+        # on the consensus partition of trials
+        membership, scores, co_membership = trials.node_scores(
+            nb_iterations,
+            broker_scores,
+            trial_arguments,
+            self.dataSet["consensus"],
+            self.dataSet["consensus threshold"],
+        )
+        if co_membership is not None:
+            self.snapshot.write_edge_values(
+                self.graph.getDoubleProperty("co_clustering"),
+                co_membership.frequencies(),
+            )
+        # communities property holds the consensus partition,
+        # or the partition found by the last trial
+        self.snapshot.write_node_values(self.community, membership)
+        for name, values in trials.statistics_columns().items():
+            self.graph.setAttribute("trial_" + name, values)
+        self.snapshot.write_node_values(broker_score, scores)
+        if self.dataSet["broker hierarchy"]:
+            self.compute_broker_network(scores, membership, nb_iterations, cohesion)
+        if self.dataSet["export communities"]:
             self.build_communities()
             self._standardize_community_names_()
-            self.collect_community_names()
-            self.compute_neighbor_communities()
-
-            C = self.compute_community_vector()
-            print(f"Community vector\n {C}")
-            M = self.compute_community_matrix()
-            print(f"Community matrix\n {M}")
-            for node in self.graph.getNodes():
-                if len(self.neighbor_communities[node]) > 0:
-                    node_vector = self.compute_node_vector(node)
-                    print(f"Node {node.id} vector {node_vector}")
-                    V = np.multiply(node_vector, C)
-                    broker_score[node] += V.dot(M.transpose())[
-                        int(self.community[node])
-                    ]
-        for node in self.graph.getNodes():
-            broker_score[node] /= nb_iterations
-        # cleanup
-        for sub in self.graph.getSubGraphs():
-            self.graph.delSubGraph(sub)
         return True
 
 
@@ -0,0 +1,97 @@
+import random
+
+from BrokerScore import *
+
+
+def test_shortest_paths():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(5)]
+    weight = G.getDoubleProperty("weight")
+    # a path 0 - 1 - 2 - 3 with a heavy shortcut 0 - 3, node 4 is isolated
+    for i, j, w in [(0, 1, 1.0), (1, 2, 1.0), (2, 3, 1.0), (0, 3, 5.0)]:
+        weight[G.addEdge(nodes[i], nodes[j])] = w
+
+    shortest_paths, positions = ShortestPaths.from_graph(G)
+    dist, parent = shortest_paths.compute_distance_from(positions.index(nodes[0]))
+    assert list(dist[:4]) == [0.0, 1.0, 2.0, 1.0]
+    assert np.isinf(dist[4]) and parent[4] == -1
+    assert parent[2] == 1
+
+    shortest_paths, positions = ShortestPaths.from_graph(G, weight)
+    dist, parent = shortest_paths.compute_distance_from(positions.index(nodes[0]))
+    assert list(dist[:4]) == [0.0, 1.0, 2.0, 3.0]
+    assert parent[3] == 2
+
+
+def test_broker_score():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(6)]
+    # two triangles bridged by the 2 - 3 edge
+    for i, j in [(0, 1), (0, 2), (1, 2), (3, 4), (3, 5), (4, 5), (2, 3)]:
+        G.addEdge(nodes[i], nodes[j])
+
+    community = G.getIntegerProperty("community")
+    broker = G.getDoubleProperty("broker_score")
+    params = tlp.getDefaultPluginParameters("Broker score", G)
+    params["communities"] = community
+    params["result"] = broker
+    params["nb iterations"] = 5
+    G.applyDoubleAlgorithm("Broker score", broker, params)
+
+    assert [broker[n] for n in nodes] == [0.0, 0.0, 6.0, 6.0, 0.0, 0.0]
+
+
+def test_broker_hierarchy():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(6)]
+    for i, j in [(0, 1), (0, 2), (1, 2), (3, 4), (3, 5), (4, 5), (2, 3)]:
+        G.addEdge(nodes[i], nodes[j])
+
+    hierarchy = BrokerHierarchy(GraphSnapshot(G), nb_iterations=5, seed=1)
+    table = hierarchy.compute()
+    # the bridge ends make up the level 1 network, the last level of the hierarchy
+    assert list(table["level"]) == [0] * 6 + [1] * 2
+    level_1 = table[table["level"] == 1]
+    assert list(level_1["node"]) == [nodes[2].id, nodes[3].id]
+
+
+def test_cached_broker_hierarchy():
+    G = tlp.newGraph()
+    nodes = G.addNodes(12)
+    rnd = random.Random(17)
+    for i in range(18):
+        G.addEdge(*rnd.sample(nodes, 2))
+
+    snapshot = GraphSnapshot(G)
+    cached = BrokerHierarchy(
+        snapshot, nb_iterations=3, seed=1, cohesion=CommunityCohesion(cache_size=10000)
+    ).compute()
+    uncached = BrokerHierarchy(
+        snapshot, nb_iterations=3, seed=1, cohesion=CommunityCohesion()
+    ).compute()
+    # levels renumber nodes from 0, communities of different levels must not be confused
+    assert cached["level"].max() >= 2
+    assert list(cached["node"]) == list(uncached["node"])
+    assert np.allclose(cached["broker_score"], uncached["broker_score"])
+
+
+def test_consensus():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(6)]
+    for i, j in [(0, 1), (0, 2), (1, 2), (3, 4), (3, 5), (4, 5), (2, 3)]:
+        G.addEdge(nodes[i], nodes[j])
+
+    community = G.getIntegerProperty("community")
+    broker = G.getDoubleProperty("broker_score")
+    params = tlp.getDefaultPluginParameters("Broker score", G)
+    params["communities"] = community
+    params["result"] = broker
+    params["nb iterations"] = 5
+    params["consensus"] = True
+    G.applyDoubleAlgorithm("Broker score", broker, params)
+
+    # the bridge never falls within a community, triangle edges always do
+    co_clustering = G.getDoubleProperty("co_clustering")
+    assert sorted(co_clustering[e] for e in G.getEdges()) == [0.0] + [1.0] * 6
+    assert [community[n] for n in nodes] == [0, 0, 0, 1, 1, 1]
+    assert [broker[n] for n in nodes] == [0.0, 0.0, 6.0, 6.0, 0.0, 0.0]
@@ -0,0 +1,96 @@
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import CommunityCohesion as cohesion_module
+from CommunityCohesion import community_cohesion, CommunityCache, CommunityCohesion
+from CommunityIndex import CommunityIndex
+
+
+def random_connected_graph(nb_nodes, nb_edges, seed):
+    rnd = random.Random(seed)
+    G = nx.path_graph(nb_nodes)
+    while G.number_of_edges() < nb_edges:
+        G.add_edge(*rnd.sample(range(nb_nodes), 2))
+    return G
+
+
+def csr(G):
+    nb_nodes = G.number_of_nodes()
+    indptr = np.zeros(nb_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([G.degree(i) for i in range(nb_nodes)])
+    indices = np.array(
+        [j for i in range(nb_nodes) for j in sorted(G[i])], dtype=np.int64
+    )
+    return indptr, indices
+
+
+def test_community_cohesion_exact(monkeypatch):
+    G = random_connected_graph(40, 90, 1)
+    indptr, indices = csr(G)
+    expected = nx.average_shortest_path_length(G)
+    cohesion, error = community_cohesion(indptr, indices)
+    assert np.isclose(cohesion, expected) and error == 0.0
+    # batches of a few sources only (bounded by the number of adjacency entries)
+    monkeypatch.setattr(cohesion_module, "_BATCH_CELLS_", 3 * len(indices))
+    cohesion, error = community_cohesion(indptr, indices)
+    assert np.isclose(cohesion, expected) and error == 0.0
+
+
+def test_community_cohesion_sampled():
+    G = random_connected_graph(200, 400, 2)
+    indptr, indices = csr(G)
+    expected = nx.average_shortest_path_length(G)
+    cohesion, error = community_cohesion(indptr, indices, nb_pivots=50, seed=3)
+    assert error > 0
+    assert abs(cohesion - expected) <= error
+    # all nodes as pivots, the cohesion is exact
+    cohesion, error = community_cohesion(indptr, indices, nb_pivots=200, seed=3)
+    assert np.isclose(cohesion, expected) and error == 0.0
+    # the error of an estimate needs at least 2 pivots
+    cohesion, error = community_cohesion(indptr, indices, nb_pivots=2, seed=3)
+    assert np.isfinite(error)
+    with pytest.raises(ValueError):
+        community_cohesion(indptr, indices, nb_pivots=1)
+    with pytest.raises(ValueError):
+        CommunityCohesion(sampling_threshold=10, nb_pivots=1)
+
+
+def test_community_cache():
+    cache = CommunityCache(max_entries=2)
+    keys = [CommunityCache.fingerprint(members) for members in ([0, 1], [2, 3], [4])]
+    assert len(set(keys)) == 3
+    assert cache.get(keys[0]) is None
+    cache.put(keys[0], (2, 1.0, 0.0, -1))
+    cache.put(keys[1], (2, 1.0, 0.0, -1))
+    assert cache.get(keys[0]) == (2, 1.0, 0.0, -1)
+    # keys[1] is the least recently used record, evicted first
+    cache.put(keys[2], (1, 0.0, 0.0, -1))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert len(cache.records) == 2
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_cached_cohesion():
+    G = random_connected_graph(60, 120, 4)
+    sources = np.array([u for u, v in G.edges()], dtype=np.int64)
+    targets = np.array([v for u, v in G.edges()], dtype=np.int64)
+    labels = np.arange(60) // 12
+    communities = CommunityIndex(labels, sources, targets)
+    # cohesion estimated from pivots, so that errors are not all 0
+    expected, expected_error = CommunityCohesion(
+        sampling_threshold=8, nb_pivots=4, seed=1
+    ).compute(communities, sources, targets)
+    assert (expected_error > 0).any()
+    engine = CommunityCohesion(sampling_threshold=8, nb_pivots=4, seed=1, cache_size=10)
+    cohesion, error = engine.compute(communities, sources, targets)
+    # the first call fills the cache, the second one is only served by it
+    assert (engine.cache.hits, engine.cache.misses) == (0, 5)
+    assert np.allclose(cohesion, expected) and np.allclose(error, expected_error)
+    cohesion, error = engine.compute(communities, sources, targets)
+    assert (engine.cache.hits, engine.cache.misses) == (5, 5)
+    assert len(engine.cache.records) == 5
+    assert np.allclose(cohesion, expected) and np.allclose(error, expected_error)
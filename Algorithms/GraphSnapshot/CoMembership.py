@@ -0,0 +1,70 @@
+# distribution packages
+import numpy as np
+
+"""
+Co-membership of nodes across community detection trials, restricted to the edges of
+the graph (memory stays linear in the number of edges).
+
+Rather than averaging node scores over many trials, meso level measures may score nodes
+once, on a consensus partition: nodes are kept together when the edge linking them
+falls within a community in most of the trials.
+"""
+
+
+def connected_labels(nb_nodes, sources, targets):
+    """
+    labels nodes by connected component (of the graph given by its edge ends),
+    labels being consecutive integers starting from 0
+
+    labels are propagated along edges (each node takes the smallest label of its
+    neighbors) and shortened by pointer jumping until they no longer change
+    """
+    labels = np.arange(nb_nodes)
+    while True:
+        previous = labels.copy()
+        smallest = np.minimum(labels[sources], labels[targets])
+        np.minimum.at(labels, sources, smallest)
+        np.minimum.at(labels, targets, smallest)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+class CoMembership(object):
+    """
+    accumulates, for each edge, the number of trials in which both its ends belong
+    to the same community
+
+    - add(membership) accounts for the partition found by one trial
+    - frequencies() gives the co-clustering frequency of edges (in edge position order)
+    - consensus(threshold) gives the consensus partition, as an array of labels
+    """
+
+    def __init__(self, nb_nodes, sources, targets):
+        self.nb_nodes = nb_nodes
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.counts = np.zeros(len(self.sources), dtype=np.int64)
+        self.nb_trials = 0
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls(snapshot.nb_nodes, snapshot.sources, snapshot.targets)
+
+    def add(self, membership):
+        membership = np.asarray(membership)
+        self.counts += membership[self.sources] == membership[self.targets]
+        self.nb_trials += 1
+
+    def frequencies(self):
+        return self.counts / max(self.nb_trials, 1)
+
+    def consensus(self, threshold=0.5):
+        """
+        consensus partition: connected components of the graph keeping the edges
+        whose ends were in the same community in more than threshold of the trials
+        (nodes left without such edges make up communities on their own)
+        """
+        kept = self.frequencies() > threshold
+        return connected_labels(self.nb_nodes, self.sources[kept], self.targets[kept])
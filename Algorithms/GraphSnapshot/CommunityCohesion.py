@@ -0,0 +1,255 @@
+# distribution packages
+import collections
+import hashlib
+import multiprocessing
+import numpy as np
+
+"""
+Cohesion (average shortest path length) of all communities of a partition.
+
+Each community is sliced out of the graph as a small CSR adjacency (nodes renumbered
+from 0 within the community) and explored by breadth first searches run from all its
+nodes at once. Communities can be dispatched to worker processes, and the cohesion of
+communities above a size threshold can be estimated from a sample of pivot sources.
+
+Trials of community detection algorithms often find the very same communities again,
+cohesion records are thus cached by a fingerprint of the community member set.
+"""
+
+# upper bound on the number of (source, node) and (source, adjacency entry) cells
+# explored by a batch of bfs
+_BATCH_CELLS_ = 1 << 22
+
+
+def bfs_distance_sums(indptr, indices, sources):
+    """
+    runs a bfs from each source (all of them at once, level by level) and returns,
+    for each source, the sum of distances to the nodes it reaches and the number of
+    these nodes (the source excluded)
+    """
+    nb_nodes = len(indptr) - 1
+    nb_sources = len(sources)
+    visited = np.zeros((nb_sources, nb_nodes), dtype=bool)
+    visited[np.arange(nb_sources), sources] = True
+    frontier_source = np.arange(nb_sources)
+    frontier_node = np.asarray(sources, dtype=np.int64)
+    distance_sums = np.zeros(nb_sources)
+    reached = np.zeros(nb_sources, dtype=np.int64)
+    level = 0
+    while len(frontier_node) > 0:
+        level += 1
+        starts = indptr[frontier_node]
+        counts = indptr[frontier_node + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            break
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        neighbors = indices[np.arange(total) + offsets]
+        owners = np.repeat(frontier_source, counts)
+        unseen = ~visited[owners, neighbors]
+        # cells reached for the first time, flagged in a matrix rather than sorted out
+        # (the matrix is no larger than visited)
+        reached_now = np.zeros_like(visited)
+        reached_now[owners[unseen], neighbors[unseen]] = True
+        keys = np.flatnonzero(reached_now)
+        frontier_source = keys // nb_nodes
+        frontier_node = keys % nb_nodes
+        visited |= reached_now
+        newly_reached = np.bincount(frontier_source, minlength=nb_sources)
+        distance_sums += level * newly_reached
+        reached += newly_reached
+    return distance_sums, reached
+
+
+def community_cohesion(indptr, indices, nb_pivots=0, seed=None):
+    """
+    average shortest path length of a (connected) community given as a CSR adjacency,
+    returns the (cohesion, error) pair
+
+    all nodes are used as sources unless nb_pivots is positive and lower than
+    the number of nodes, the cohesion is then estimated from nb_pivots sources drawn
+    at random and error is the half width of a 95% confidence interval
+    (normal approximation, with finite population correction), which takes at least
+    2 pivots
+    """
+    if nb_pivots == 1:
+        raise ValueError("cohesion is estimated from at least 2 pivots")
+    nb_nodes = len(indptr) - 1
+    if nb_nodes <= 1:
+        return 0.0, 0.0
+    sampled = 0 < nb_pivots < nb_nodes
+    if sampled:
+        rng = np.random.default_rng(seed)
+        sources = np.sort(rng.choice(nb_nodes, nb_pivots, replace=False))
+    else:
+        sources = np.arange(nb_nodes)
+    # a level of the bfs may expand every adjacency entry for every source of the batch
+    batch = max(1, _BATCH_CELLS_ // max(len(indices), nb_nodes))
+    distance_sums = np.zeros(len(sources))
+    reached = np.zeros(len(sources), dtype=np.int64)
+    for i in range(0, len(sources), batch):
+        distance_sums[i : i + batch], reached[i : i + batch] = bfs_distance_sums(
+            indptr, indices, sources[i : i + batch]
+        )
+    if not sampled:
+        # average over all (ordered) pairs of connected nodes
+        return distance_sums.sum() / max(reached.sum(), 1), 0.0
+    averages = distance_sums / np.maximum(reached, 1)
+    correction = (nb_nodes - nb_pivots) / (nb_nodes - 1)
+    error = 1.96 * np.sqrt(averages.var(ddof=1) / nb_pivots * correction)
+    return averages.mean(), error
+
+
+def _community_cohesion_(task):
+    return community_cohesion(*task)
+
+
+class CommunityCache(object):
+    """
+    least recently used cache of community records (size, cohesion, cohesion error,
+    number of brokers) keyed by a fingerprint of the (sorted) member positions
+
+    the cache holds at most max_entries records, hits and misses are counted
+
+    keys only depend on member positions: they are valid within one snapshot (one node
+    numbering) only, communities of another numbering (such as a restricted snapshot,
+    whose nodes are renumbered from 0) must be cached apart
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.records = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(members):
+        members = np.ascontiguousarray(members, dtype=np.int64)
+        return hashlib.blake2b(members.tobytes(), digest_size=16).digest()
+
+    def get(self, key):
+        record = self.records.get(key)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.records.move_to_end(key)
+        return record
+
+    def put(self, key, record):
+        self.records[key] = record
+        self.records.move_to_end(key)
+        while len(self.records) > self.max_entries:
+            self.records.popitem(last=False)
+
+
+class CommunityCohesion(object):
+    """
+    computes the cohesion of all communities of a CommunityIndex
+
+    communities with more than sampling_threshold nodes (when positive) have their
+    cohesion estimated from nb_pivots (at least 2) sources; communities are processed in a pool of
+    nb_workers processes, unless already running in a worker process (pools do not nest)
+
+    records of communities are cached across calls when cache_size is positive
+    (each worker process holding its own cache)
+    """
+
+    def __init__(
+        self,
+        nb_workers=1,
+        sampling_threshold=0,
+        nb_pivots=100,
+        seed=None,
+        cache_size=0,
+    ):
+        if sampling_threshold > 0 and nb_pivots < 2:
+            raise ValueError("cohesion is estimated from at least 2 pivots")
+        self.nb_workers = nb_workers
+        self.sampling_threshold = sampling_threshold
+        self.nb_pivots = nb_pivots
+        self.seed = seed
+        self.cache = CommunityCache(cache_size) if cache_size > 0 else None
+
+    def renumbered(self):
+        """
+        engine with the same settings and an empty cache (of the same size), for
+        communities of another node numbering (cache keys only hold for one numbering)
+        """
+        engine = CommunityCohesion(
+            self.nb_workers, self.sampling_threshold, self.nb_pivots, self.seed
+        )
+        if self.cache is not None:
+            engine.cache = CommunityCache(self.cache.max_entries)
+        return engine
+
+    def _local_positions_(self, communities):
+        # rank of each node within its community
+        local_position = np.zeros(len(communities.labels), dtype=np.int64)
+        local_position[communities.member_list] = (
+            np.arange(len(communities.labels))
+            - communities.member_indptr[communities.labels[communities.member_list]]
+        )
+        return local_position
+
+    def community_adjacency(self, communities, c, sources, targets, local_position):
+        """
+        slices the (undirected) CSR adjacency of community c out of the edge list,
+        nodes being renumbered by their rank within their community
+        """
+        edges = communities.induced_edges(c)
+        s = local_position[sources[edges]]
+        t = local_position[targets[edges]]
+        ends = np.concatenate([s, t])
+        order = np.argsort(ends, kind="stable")
+        indptr = np.zeros(communities.sizes[c] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=communities.sizes[c]), out=indptr[1:])
+        return indptr, np.concatenate([t, s])[order]
+
+    def compute(self, communities, sources, targets, brokers=None):
+        """
+        returns the arrays of cohesion and error (0 for exactly computed cohesions)
+        indexed by communities
+
+        brokers optionally flags broker nodes, their number per community is then
+        recorded (in the cache) together with the community size and cohesion
+        """
+        k = communities.nb_communities
+        seeds = np.random.SeedSequence(self.seed).generate_state(k)
+        local_position = self._local_positions_(communities)
+        nb_brokers = np.full(k, -1)
+        if brokers is not None:
+            nb_brokers = np.bincount(communities.labels[brokers], minlength=k)
+        results = [None] * k
+        keys = [None] * k
+        tasks = []
+        for c in range(k):
+            if self.cache is not None:
+                keys[c] = CommunityCache.fingerprint(communities.members(c))
+                record = self.cache.get(keys[c])
+                if record is not None:
+                    results[c] = record[1:3]
+                    continue
+            indptr, indices = self.community_adjacency(
+                communities, c, sources, targets, local_position
+            )
+            sampled = 0 < self.sampling_threshold < communities.sizes[c]
+            nb_pivots = self.nb_pivots if sampled else 0
+            tasks.append((c, (indptr, indices, nb_pivots, int(seeds[c]))))
+        in_worker = multiprocessing.current_process().daemon
+        if self.nb_workers <= 1 or in_worker or len(tasks) <= 1:
+            computed = [_community_cohesion_(task) for _, task in tasks]
+        else:
+            # largest communities first, for a better balance between workers
+            tasks.sort(key=lambda task: -len(task[1][0]))
+            with multiprocessing.Pool(min(self.nb_workers, len(tasks))) as pool:
+                computed = pool.map(_community_cohesion_, [task for _, task in tasks])
+        for (c, _), (cohesion, error) in zip(tasks, computed):
+            result = (float(cohesion), float(error))
+            results[c] = result
+            if self.cache is not None:
+                record = (int(communities.sizes[c]),) + result + (int(nb_brokers[c]),)
+                self.cache.put(keys[c], record)
+        cohesion = np.array([r[0] for r in results], dtype=float)
+        error = np.array([r[1] for r in results], dtype=float)
+        return cohesion, error
@@ -0,0 +1,53 @@
+# distribution packages
+import numpy as np
+
+"""
+In memory index of a community structure (partition of the nodes of a graph snapshot).
+
+Meso level measures used to materialize communities as Tulip subgraphs and look them up
+by name. The index rather holds, for a label array assigning a community to each node
+position, community sizes, member lists and induced edge lists, all stored as numpy arrays.
+It only depends on arrays and can thus be built (and pickled) in worker processes.
+"""
+
+
+class CommunityIndex(object):
+    """
+    index of a partition given as an array of labels (community of each node position),
+    labels are expected to be consecutive integers starting from 0
+
+    - sizes[c] is the number of nodes in community c
+    - members(c) gives the positions of nodes in c
+    - induced_edges(c) gives the positions of edges with both ends in c
+    """
+
+    def __init__(self, labels, sources, targets):
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.nb_communities = int(self.labels.max(initial=-1) + 1)
+        self.sizes = np.bincount(self.labels, minlength=self.nb_communities)
+        self.member_list = np.argsort(self.labels, kind="stable")
+        self.member_indptr = np.zeros(self.nb_communities + 1, dtype=np.int64)
+        np.cumsum(self.sizes, out=self.member_indptr[1:])
+        source_labels = self.labels[sources]
+        internal = np.flatnonzero(source_labels == self.labels[targets])
+        order = np.argsort(source_labels[internal], kind="stable")
+        self.edge_list = internal[order]
+        self.edge_indptr = np.zeros(self.nb_communities + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(source_labels[internal], minlength=self.nb_communities),
+            out=self.edge_indptr[1:],
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot, labels):
+        return cls(labels, snapshot.sources, snapshot.targets)
+
+    def members(self, community):
+        return self.member_list[
+            self.member_indptr[community] : self.member_indptr[community + 1]
+        ]
+
+    def induced_edges(self, community):
+        return self.edge_list[
+            self.edge_indptr[community] : self.edge_indptr[community + 1]
+        ]
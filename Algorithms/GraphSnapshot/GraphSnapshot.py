@@ -0,0 +1,222 @@
+# distribution packages
+import numpy as np
+
+"""
+Array based snapshot of a Tulip graph, shared by the PyTulip algorithms.
+
+Walking a `tlp.Graph` through `getInOutNodes` and friends crosses the python binding
+on every single neighbor access. Algorithms that visit neighborhoods over and over
+(inside nested loops, or along thousands of trials) rather build a `GraphSnapshot`
+once and run their inner loops over numpy arrays.
+
+Nodes and edges are referred to by their position in the snapshot (0 .. n-1 and 0 .. m-1),
+Tulip ids are kept in the `node_ids` and `edge_ids` arrays. The snapshot is a copy,
+it does not follow later updates of the graph.
+"""
+
+
+class Adjacency(object):
+    """
+    compressed sparse row (CSR) adjacency
+
+    neighbors of the node at position i are indices[indptr[i]:indptr[i + 1]]
+    and edges[indptr[i]:indptr[i + 1]] are the positions of the corresponding edges
+    """
+
+    def __init__(self, sources, targets, nb_nodes):
+        """
+        builds the adjacency from aligned arrays of source and target positions,
+        the k-th entry standing for the edge at position k
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        self.indptr = np.zeros(nb_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=nb_nodes), out=self.indptr[1:])
+        self.indices = targets[order]
+        self.edges = order
+        self.nb_nodes = nb_nodes
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def incident_edges(self, i):
+        return self.edges[self.indptr[i] : self.indptr[i + 1]]
+
+    def owners(self):
+        """
+        position of the node each entry of indices belongs to
+        (the "row" array of the sparse matrix in coordinate format)
+        """
+        return np.repeat(np.arange(self.nb_nodes), self.degree())
+
+
+class GraphSnapshot(object):
+    """
+    snapshot of a Tulip graph (or subgraph) stored as numpy arrays:
+
+    - node_ids / edge_ids, Tulip ids of nodes and edges in position order
+    - sources / targets, positions of the ends of each edge
+    - out_adjacency / in_adjacency / adjacency, CSR adjacencies
+      (adjacency ignores edge direction, each edge is listed from both ends)
+    - out_degree / in_degree / degree
+    - node and edge columns pulled from graph properties
+
+    results computed over the arrays are written back to Tulip properties
+    in bulk, with write_node_values / write_edge_values
+    """
+
+    def __init__(self, graph, node_properties=[], edge_properties=[]):
+        self.graph = graph
+        self.nodes = graph.nodes()
+        self.edges = graph.edges()
+        self.nb_nodes = len(self.nodes)
+        self.nb_edges = len(self.edges)
+        self.node_ids = np.array([n.id for n in self.nodes], dtype=np.int64)
+        self.edge_ids = np.array([e.id for e in self.edges], dtype=np.int64)
+        # Tulip ids are not contiguous in subgraphs, hence the id -> position lookup array
+        self._node_position_ = np.full(
+            self.node_ids.max(initial=-1) + 1, -1, dtype=np.int64
+        )
+        self._node_position_[self.node_ids] = np.arange(self.nb_nodes)
+        ends = np.array(
+            [(s.id, t.id) for s, t in map(graph.ends, self.edges)], dtype=np.int64
+        ).reshape(-1, 2)
+        self.sources = self._node_position_[ends[:, 0]]
+        self.targets = self._node_position_[ends[:, 1]]
+        self.out_degree = np.bincount(self.sources, minlength=self.nb_nodes)
+        self.in_degree = np.bincount(self.targets, minlength=self.nb_nodes)
+        self.degree = self.out_degree + self.in_degree
+        self._out_adjacency_ = None
+        self._in_adjacency_ = None
+        self._adjacency_ = None
+        self.node_columns = {}
+        self.edge_columns = {}
+        for p in node_properties:
+            self.node_column(p)
+        for p in edge_properties:
+            self.edge_column(p)
+
+    @property
+    def out_adjacency(self):
+        if self._out_adjacency_ is None:
+            self._out_adjacency_ = Adjacency(self.sources, self.targets, self.nb_nodes)
+        return self._out_adjacency_
+
+    @property
+    def in_adjacency(self):
+        if self._in_adjacency_ is None:
+            self._in_adjacency_ = Adjacency(self.targets, self.sources, self.nb_nodes)
+        return self._in_adjacency_
+
+    @property
+    def adjacency(self):
+        if self._adjacency_ is None:
+            adjacency = Adjacency(
+                np.concatenate([self.sources, self.targets]),
+                np.concatenate([self.targets, self.sources]),
+                self.nb_nodes,
+            )
+            # both copies of an edge point back to the same edge position
+            adjacency.edges %= max(self.nb_edges, 1)
+            self._adjacency_ = adjacency
+        return self._adjacency_
+
+    def restrict(self, node_mask):
+        """
+        restricts the snapshot to the subgraph induced by the nodes flagged in node_mask
+        (a boolean array indexed by node positions) without going back to Tulip
+
+        returns the (positions, sources, targets) triple: snapshot positions of kept nodes,
+        and ends of kept edges renumbered over these nodes (0 .. len(positions) - 1)
+        """
+        node_mask = np.asarray(node_mask, dtype=bool)
+        positions = np.flatnonzero(node_mask)
+        renumbered = np.cumsum(node_mask) - 1
+        kept = node_mask[self.sources] & node_mask[self.targets]
+        return positions, renumbered[self.sources[kept]], renumbered[self.targets[kept]]
+
+    def incidence_ranks(self):
+        """
+        rank of the edge behind each entry of adjacency in the incidence list of
+        its node, as given by getInOutEdges
+
+        Tulip lists incident edges in the order they were added to the node, which
+        neither edge ids (recycled after deletions) nor edge positions follow
+        """
+        edge_position = np.full(self.edge_ids.max(initial=-1) + 1, -1, dtype=np.int64)
+        edge_position[self.edge_ids] = np.arange(self.nb_edges)
+        incidence = [[e.id for e in self.graph.getInOutEdges(n)] for n in self.nodes]
+        degree = np.array([len(edges) for edges in incidence], dtype=np.int64)
+        owners = np.repeat(np.arange(self.nb_nodes), degree)
+        edges = edge_position[
+            np.array([i for edges in incidence for i in edges], dtype=np.int64)
+        ]
+        ranks = np.arange(len(edges)) - np.repeat(np.cumsum(degree) - degree, degree)
+        # (node, edge) keys of the incidence lists, looked up for adjacency entries
+        # (both entries of a loop get the rank of its first occurrence)
+        keys = owners * max(self.nb_edges, 1) + edges
+        order = np.argsort(keys, kind="stable")
+        adjacency = self.adjacency
+        wanted = adjacency.owners() * max(self.nb_edges, 1) + adjacency.edges
+        return ranks[order][np.searchsorted(keys[order], wanted)]
+
+    def node_position(self, node):
+        return int(self._node_position_[node.id])
+
+    def node_positions(self, nodes):
+        return self._node_position_[np.array([n.id for n in nodes], dtype=np.int64)]
+
+    def _property_(self, prop):
+        if isinstance(prop, str):
+            return self.graph.getProperty(prop)
+        return prop
+
+    def node_column(self, prop, dtype=None):
+        """
+        values of a node property (given by name or as a property) as a numpy array,
+        columns are cached by property name
+        """
+        prop = self._property_(prop)
+        name = prop.getName()
+        if name not in self.node_columns:
+            self.node_columns[name] = np.array(
+                [prop[n] for n in self.nodes], dtype=dtype
+            )
+        return self.node_columns[name]
+
+    def edge_column(self, prop, dtype=None):
+        """
+        values of an edge property (given by name or as a property) as a numpy array,
+        columns are cached by property name
+        """
+        prop = self._property_(prop)
+        name = prop.getName()
+        if name not in self.edge_columns:
+            self.edge_columns[name] = np.array(
+                [prop[e] for e in self.edges], dtype=dtype
+            )
+        return self.edge_columns[name]
+
+    def write_node_values(self, prop, values):
+        """
+        writes an array of values (in node position order) into a Tulip property
+        """
+        prop = self._property_(prop)
+        prop.holdObservers()
+        for n, v in zip(self.nodes, np.asarray(values).tolist()):
+            prop[n] = v
+        prop.unholdObservers()
+
+    def write_edge_values(self, prop, values):
+        """
+        writes an array of values (in edge position order) into a Tulip property
+        """
+        prop = self._property_(prop)
+        prop.holdObservers()
+        for e, v in zip(self.edges, np.asarray(values).tolist()):
+            prop[e] = v
+        prop.unholdObservers()
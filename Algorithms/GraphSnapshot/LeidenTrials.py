@@ -0,0 +1,195 @@
+# distribution packages
+import multiprocessing
+import time
+import numpy as np
+import leidenalg
+from iGraphConverter import igraph_from_arrays
+from CoMembership import CoMembership
+
+"""
+Independent Leiden community detection trials, shared by the meso level measures
+(broker score, participation coefficient) averaging node scores over many trials.
+
+Trials only depend on the edge list of the graph, which is shipped once to each
+worker process together with the per trial scoring function, and converted once
+to an igraph graph (per worker, or per runner when trials run in the calling process).
+Each trial gets its own
+seed, drawn from a seed sequence, so that runs can be reproduced whatever the number
+of workers.
+
+Node scores are either averaged over trials, or computed once on the consensus
+partition of trials (see CoMembership), by `node_scores`.
+
+Statistics of each trial (modularity of the partition, as computed by leidenalg, number
+of communities and timings) can optionally be collected by the runner.
+"""
+
+# state of a worker process, set once by _init_worker_
+_worker_ = {}
+
+
+def _init_worker_(
+    nb_nodes, sources, targets, trial_function, trial_arguments, graph=None
+):
+    if graph is None:
+        graph = igraph_from_arrays(nb_nodes, sources, targets)
+    _worker_["graph"] = graph
+    _worker_["trial_function"] = trial_function
+    _worker_["trial_arguments"] = trial_arguments
+
+
+def _run_trial_(seed):
+    start = time.perf_counter()
+    partition = leidenalg.find_partition(
+        _worker_["graph"], leidenalg.ModularityVertexPartition, seed=seed
+    )
+    membership = np.array(partition.membership, dtype=np.int64)
+    statistics = {
+        "seed": seed,
+        "modularity": partition.modularity,
+        "nb_communities": len(partition),
+        "leiden_time": time.perf_counter() - start,
+        "scoring_time": 0.0,
+    }
+    if _worker_["trial_function"] is None:
+        return membership, None, statistics
+    start = time.perf_counter()
+    result = _worker_["trial_function"](membership, *_worker_["trial_arguments"])
+    statistics["scoring_time"] = time.perf_counter() - start
+    return membership, result, statistics
+
+
+class LeidenTrials(object):
+    """
+    runs independent Leiden trials over an edge list given as arrays of node positions,
+    either in the calling process (nb_workers <= 1) or in a pool of worker processes
+
+    the optional trial function is called on each partition as
+    trial_function(membership, *trial_arguments) and must be defined at module level
+    (it is pickled by reference when sent to the workers)
+
+    when collect_statistics is set, a record is appended to the statistics list for each
+    trial: seed, modularity of the partition, number of communities, time spent running
+    the Leiden algorithm and the trial function (leiden_time, scoring_time, in seconds)
+    """
+
+    def __init__(
+        self,
+        nb_nodes,
+        sources,
+        targets,
+        nb_workers=1,
+        seed=None,
+        collect_statistics=False,
+    ):
+        self.nb_nodes = nb_nodes
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.nb_workers = nb_workers
+        self.seed = seed
+        self._graph_ = None
+        self.statistics = [] if collect_statistics else None
+
+    @classmethod
+    def from_snapshot(cls, snapshot, nb_workers=1, seed=None, collect_statistics=False):
+        return cls(
+            snapshot.nb_nodes,
+            snapshot.sources,
+            snapshot.targets,
+            nb_workers,
+            seed,
+            collect_statistics,
+        )
+
+    @property
+    def graph(self):
+        """
+        igraph graph the trials run on, built once and reused by later runs
+        in the calling process
+        """
+        if self._graph_ is None:
+            self._graph_ = igraph_from_arrays(self.nb_nodes, self.sources, self.targets)
+        return self._graph_
+
+    def seeds(self, nb_trials):
+        """
+        one seed per trial, derived from the seed of the runner
+        (a fresh entropy source is used when no seed was given)
+        """
+        states = np.random.SeedSequence(self.seed).generate_state(nb_trials)
+        return [int(s) & 0x7FFFFFFF for s in states]
+
+    def run(self, nb_trials, trial_function=None, trial_arguments=()):
+        """
+        yields a (membership, trial result) pair per trial, in trial order,
+        membership being the array of community indices of nodes
+        """
+        seeds = self.seeds(nb_trials)
+        initargs = (
+            self.nb_nodes,
+            self.sources,
+            self.targets,
+            trial_function,
+            trial_arguments,
+        )
+        if self.nb_workers <= 1 or nb_trials <= 1:
+            _init_worker_(*initargs, self.graph)
+            try:
+                for seed in seeds:
+                    yield self._record_(*_run_trial_(seed))
+            finally:
+                _worker_.clear()
+            return
+        with multiprocessing.Pool(
+            min(self.nb_workers, nb_trials), _init_worker_, initargs
+        ) as pool:
+            for result in pool.imap(_run_trial_, seeds):
+                yield self._record_(*result)
+
+    def node_scores(
+        self,
+        nb_trials,
+        trial_function,
+        trial_arguments=(),
+        consensus=False,
+        threshold=0.5,
+    ):
+        """
+        scores nodes over nb_trials trials, trial results (arrays of node scores, one
+        column per node) being averaged, or in consensus mode, computed once on the
+        consensus partition of trials (see CoMembership): trials then only find
+        communities and the trial arguments are not shipped to the workers
+
+        returns the (membership, scores, co_membership) triple: partition found by the
+        last trial (or consensus partition), scores and co-membership of trials
+        (None when scores are averaged)
+        """
+        if consensus:
+            co_membership = CoMembership(self.nb_nodes, self.sources, self.targets)
+            for membership, _ in self.run(nb_trials):
+                co_membership.add(membership)
+            membership = co_membership.consensus(threshold)
+            return (
+                membership,
+                trial_function(membership, *trial_arguments),
+                co_membership,
+            )
+        scores = 0.0
+        for membership, trial_scores in self.run(
+            nb_trials, trial_function, trial_arguments
+        ):
+            scores = scores + trial_scores
+        return membership, scores / nb_trials, None
+
+    def statistics_columns(self):
+        """
+        collected statistics as a dict of lists (one list per statistic, in trial order)
+        """
+        if not self.statistics:
+            return {}
+        return {key: [s[key] for s in self.statistics] for key in self.statistics[0]}
+
+    def _record_(self, membership, result, statistics):
+        if self.statistics is not None:
+            self.statistics.append(statistics)
+        return membership, result
@@ -0,0 +1,190 @@
+# distribution packages
+import bisect
+import numpy as np
+
+"""
+Random walks over the CSR adjacency of a `GraphSnapshot`, shared by the walk based measures.
+
+A walk is described by a `WalkKernel` (how the next node is chosen) rather than by
+methods called on every step. Kernels are compiled once into flat tables (neighbor lists,
+cumulative edge weights, acceptance probabilities) and a single stepping core, `walk_steps`,
+runs any kernel: random numbers are drawn by batches and the nodes visited by the walk
+are handed over by chunks of ticks, so that measures only do their accounting once per
+chunk (over numpy arrays).
+"""
+
+# number of steps whose random numbers are drawn at once by the stepping core
+BATCH_SIZE = 1 << 16
+
+
+class WalkKernel(object):
+    """
+    declarative description of a random walk step
+
+    - transition: "uniform" (neighbor drawn uniformly at random), "metropolis" (neighbor
+      drawn uniformly at random and accepted with probability min(1, deg(u) / deg(v)),
+      giving a uniform stationary distribution) or "weighted" (neighbor drawn with a
+      probability proportional to the weight of the edge leading to it)
+    - weights, edge weights (in snapshot edge order) of the weighted transition
+    - laziness, probability of staying on the active node at each step
+    - restart, probability of jumping back to a restart node at each step (also taken
+      from nodes without neighbors), restart nodes default to the initial node of the walk
+    - count_stays, whether steps not moving the walk (lazy steps, rejected moves, loops)
+      count as ticks
+    """
+
+    TRANSITIONS = ("uniform", "metropolis", "weighted")
+
+    def __init__(
+        self,
+        transition="uniform",
+        weights=None,
+        laziness=0.0,
+        restart=0.0,
+        restart_nodes=None,
+        count_stays=True,
+    ):
+        if transition not in WalkKernel.TRANSITIONS:
+            raise ValueError("unknown transition: %s" % transition)
+        if transition == "weighted" and weights is None:
+            raise ValueError("the weighted transition requires edge weights")
+        if laziness < 0 or restart < 0 or laziness >= 1 or laziness + restart > 1:
+            raise ValueError("laziness and restart must be probabilities")
+        self.transition = transition
+        self.weights = weights
+        self.laziness = laziness
+        self.restart = restart
+        self.restart_nodes = restart_nodes
+        self.count_stays = count_stays
+
+    @classmethod
+    def metropolis(cls):
+        """
+        Metropolis walk whose ticks only count actual moves (second order centrality)
+        """
+        return cls("metropolis", count_stays=False)
+
+    def compile(self, indptr, indices, edges=None):
+        """
+        compiles the kernel for a CSR adjacency (see GraphSnapshot), edges giving the
+        edge position behind each entry (only needed by the weighted transition)
+        """
+        return CompiledKernel(self, indptr, indices, edges)
+
+
+class CompiledKernel(object):
+    """
+    tables of a kernel over a given adjacency, as python lists (scalar accesses to
+    lists are faster than to numpy arrays in the stepping loop)
+    """
+
+    def __init__(self, kernel, indptr, indices, edges=None):
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        degree = np.diff(indptr)
+        self.nb_nodes = len(degree)
+        self.indptr = indptr.tolist()
+        self.indices = indices.tolist()
+        self.cumulative = None
+        self.row_base = None
+        self.row_weight = None
+        self.accept = None
+        if kernel.transition == "weighted":
+            weights = np.asarray(kernel.weights, dtype=float)[edges]
+            if (weights < 0).any():
+                raise ValueError("edge weights must not be negative")
+            cumulative = np.cumsum(weights)
+            bounds = np.concatenate([[0.0], cumulative])[indptr]
+            base = bounds[:-1]
+            row_weight = np.diff(bounds)
+            # nodes whose edges all weigh 0 have no way out
+            degree = np.where(row_weight > 0, degree, 0)
+            self.cumulative = cumulative.tolist()
+            self.row_base = base.tolist()
+            self.row_weight = row_weight.tolist()
+        elif kernel.transition == "metropolis":
+            owners = np.repeat(np.arange(self.nb_nodes), degree)
+            self.accept = np.minimum(
+                1.0, degree[owners] / np.maximum(degree[indices], 1)
+            ).tolist()
+        self.degree = degree.tolist()
+        self.laziness = kernel.laziness
+        self.restart = kernel.restart
+        self.restart_nodes = (
+            None
+            if kernel.restart_nodes is None
+            else np.asarray(kernel.restart_nodes, dtype=np.int64).tolist()
+        )
+        self.count_stays = kernel.count_stays
+
+
+def walk_steps(compiled, start, nb_ticks, rng, batch_size=BATCH_SIZE):
+    """
+    runs a walk from the node at position start until nb_ticks ticks have elapsed,
+    according to a compiled kernel; the node visited at each tick is yielded by chunks
+    (numpy arrays) of at most batch_size ticks
+
+    the walk ends early when it gets stuck on a node without neighbors (and no restart)
+    while stays do not count as ticks
+    """
+    ptr = compiled.indptr
+    ind = compiled.indices
+    deg = compiled.degree
+    cumulative = compiled.cumulative
+    row_base = compiled.row_base
+    row_weight = compiled.row_weight
+    accept = compiled.accept
+    restart = compiled.restart
+    jump = compiled.restart + compiled.laziness
+    restart_nodes = (
+        [start] if compiled.restart_nodes is None else compiled.restart_nodes
+    )
+    count_stays = compiled.count_stays
+    # restarting from a node without neighbors is no way out
+    can_restart = restart > 0 and any(deg[r] > 0 for r in restart_nodes)
+    # random numbers of a step: neighbor, acceptance, and restart or lazy step if any
+    per_step = 3 if jump > 0 else 2
+    chunk = np.empty(min(nb_ticks, batch_size), dtype=np.int64)
+    filled = 0
+    tick = 0
+    u = start
+    draws = []
+    k = 0
+    while tick < nb_ticks:
+        if k == len(draws):
+            draws = rng.random(per_step * batch_size).tolist()
+            k = 0
+        d = deg[u]
+        v = u
+        if jump > 0 and draws[k + 2] < jump:
+            if draws[k + 2] < restart:
+                v = restart_nodes[int(draws[k + 2] / restart * len(restart_nodes))]
+        elif d == 0:
+            if can_restart:
+                v = restart_nodes[int(draws[k] * len(restart_nodes))]
+            elif not count_stays:
+                # stuck, the walk cannot tick anymore
+                break
+        else:
+            if cumulative is None:
+                e = ptr[u] + int(draws[k] * d)
+            else:
+                e = bisect.bisect_right(
+                    cumulative,
+                    row_base[u] + draws[k] * row_weight[u],
+                    ptr[u],
+                    ptr[u + 1] - 1,
+                )
+            if accept is None or draws[k + 1] < accept[e]:
+                v = ind[e]
+        k += per_step
+        if v != u or count_stays:
+            chunk[filled] = v
+            filled += 1
+            tick += 1
+            if filled == len(chunk):
+                yield chunk.copy()
+                filled = 0
+        u = v
+    if filled > 0:
+        yield chunk[:filled].copy()
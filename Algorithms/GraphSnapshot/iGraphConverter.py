@@ -0,0 +1,75 @@
+# distribution packages
+import numpy as np
+import igraph
+from GraphSnapshot import GraphSnapshot
+
+"""
+Conversion of Tulip graphs to igraph graphs (used by the igraph implementation
+of the Leiden algorithm), shared by the PyTulip algorithms.
+
+The igraph graph is built from the edge arrays of a `GraphSnapshot` in a single
+`add_edges` call: vertex i is the node at position i in the snapshot and edge k is
+the edge at position k, so that property values are carried over as whole columns
+(multiple edges between the same nodes included) without any lookup table.
+"""
+
+
+def igraph_from_arrays(nb_nodes, sources, targets, directed=True):
+    """
+    igraph graph with nb_nodes vertices and one edge per (source, target) pair,
+    edges keep the order of the arrays
+    """
+    i_graph = igraph.Graph(n=nb_nodes, directed=directed)
+    edges = np.column_stack([sources, targets]).astype(np.int64, copy=False)
+    i_graph.add_edges(edges)
+    return i_graph
+
+
+class iGraphConverter(object):
+    """
+    Utility class to convert graphs between formats,
+    basically Tulip and iGraph
+
+    the igraph graph is built once and cached by the converter, later calls to
+    to_igraph (typically one per community detection trial) only export properties
+    not exported yet; the converter relies on a snapshot of the Tulip graph and does not
+    follow its later updates (a new converter must then be built)
+    """
+
+    def __init__(self, tulip_graph, snapshot=None):
+        super(iGraphConverter, self).__init__()
+        self.tulip_graph = tulip_graph
+        self.snapshot = GraphSnapshot(tulip_graph) if snapshot is None else snapshot
+        self._igraph_ = None
+
+    def node_index(self, tulip_node):
+        """
+        index in the igraph graph of a Tulip node
+        """
+        return self.snapshot.node_position(tulip_node)
+
+    def to_igraph(self, exported_node_properties=[], exported_edge_properties=[]):
+        if self._igraph_ is None:
+            self._igraph_ = igraph_from_arrays(
+                self.snapshot.nb_nodes, self.snapshot.sources, self.snapshot.targets
+            )
+        for p in exported_node_properties:
+            if p not in self._igraph_.vs.attributes():
+                self.write_node_property(self._igraph_, p)
+        for p in exported_edge_properties:
+            if p not in self._igraph_.es.attributes():
+                self.write_edge_property(self._igraph_, p)
+        return self._igraph_
+
+    def write_node_property(self, i_graph, property_name):
+        i_graph.vs[property_name] = self.snapshot.node_column(property_name).tolist()
+
+    def write_edge_property(self, i_graph, property_name):
+        # igraph edges are in snapshot edge order
+        i_graph.es[property_name] = self.snapshot.edge_column(property_name).tolist()
+
+    def write_membership(self, tulip_property, membership):
+        """
+        writes vertex values (such as a community membership) back into a Tulip property
+        """
+        self.snapshot.write_node_values(tulip_property, membership)
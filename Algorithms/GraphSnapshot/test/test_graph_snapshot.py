@@ -0,0 +1,114 @@
+import numpy as np
+from tulip import tlp
+
+from GraphSnapshot import GraphSnapshot
+
+
+def subgraph_with_holes():
+    """
+    subgraph over nodes with non contiguous ids, of a graph where an edge was deleted
+    (its id is recycled by a later edge), with a multiple edge and a loop
+    """
+    G = tlp.newGraph()
+    nodes = G.addNodes(10)
+    for u, v in [(1, 3), (3, 4), (4, 1), (7, 3), (9, 7), (2, 5), (1, 9), (4, 9)]:
+        G.addEdge(nodes[u], nodes[v])
+    G.delEdge(G.existEdge(nodes[3], nodes[4]))
+    for u, v in [(9, 4), (1, 3), (7, 7)]:
+        G.addEdge(nodes[u], nodes[v])
+    sub = G.inducedSubGraph([nodes[i] for i in (1, 3, 4, 7, 9)])
+    return G, sub
+
+
+def test_arrays():
+    G, sub = subgraph_with_holes()
+    snapshot = GraphSnapshot(sub)
+    assert list(snapshot.node_ids) == [1, 3, 4, 7, 9]
+    assert list(snapshot.edge_ids) == [e.id for e in sub.edges()]
+    for k, e in enumerate(sub.edges()):
+        assert snapshot.nodes[snapshot.sources[k]] == sub.source(e)
+        assert snapshot.nodes[snapshot.targets[k]] == sub.target(e)
+    for i, n in enumerate(sub.nodes()):
+        assert snapshot.node_position(n) == i
+        assert snapshot.out_degree[i] == sub.outdeg(n)
+        assert snapshot.in_degree[i] == sub.indeg(n)
+        assert snapshot.degree[i] == sub.deg(n)
+
+
+def test_adjacencies():
+    G, sub = subgraph_with_holes()
+    snapshot = GraphSnapshot(sub)
+    edges = list(range(snapshot.nb_edges))
+    sources, targets = snapshot.sources, snapshot.targets
+    for i in range(snapshot.nb_nodes):
+        out_edges = [k for k in edges if sources[k] == i]
+        in_edges = [k for k in edges if targets[k] == i]
+        # entries follow edge positions (out entries first, for the undirected adjacency)
+        out_adjacency = snapshot.out_adjacency
+        assert list(out_adjacency.incident_edges(i)) == out_edges
+        assert list(out_adjacency.neighbors(i)) == [targets[k] for k in out_edges]
+        in_adjacency = snapshot.in_adjacency
+        assert list(in_adjacency.incident_edges(i)) == in_edges
+        assert list(in_adjacency.neighbors(i)) == [sources[k] for k in in_edges]
+        adjacency = snapshot.adjacency
+        assert list(adjacency.incident_edges(i)) == out_edges + in_edges
+        assert list(adjacency.neighbors(i)) == [targets[k] for k in out_edges] + [
+            sources[k] for k in in_edges
+        ]
+    assert len(snapshot.adjacency.indices) == 2 * snapshot.nb_edges
+    assert list(snapshot.adjacency.owners()) == list(
+        np.repeat(np.arange(snapshot.nb_nodes), snapshot.degree)
+    )
+
+
+def test_restrict():
+    G, sub = subgraph_with_holes()
+    snapshot = GraphSnapshot(sub)
+    kept = [1, 3, 4]
+    positions, sources, targets = snapshot.restrict(
+        np.isin(np.arange(snapshot.nb_nodes), kept)
+    )
+    assert list(positions) == kept
+    induced = sub.inducedSubGraph([snapshot.nodes[i] for i in kept])
+    # kept edges in position order, ends renumbered over kept nodes
+    ends = [
+        (kept.index(snapshot.node_position(s)), kept.index(snapshot.node_position(t)))
+        for s, t in map(sub.ends, sub.edges())
+        if induced.isElement(s) and induced.isElement(t)
+    ]
+    assert len(ends) == induced.numberOfEdges()
+    assert list(zip(sources, targets)) == ends
+
+
+def test_incidence_ranks():
+    G, sub = subgraph_with_holes()
+    snapshot = GraphSnapshot(sub)
+    adjacency = snapshot.adjacency
+    ranks = snapshot.incidence_ranks()
+    for i, n in enumerate(snapshot.nodes):
+        entries = range(adjacency.indptr[i], adjacency.indptr[i + 1])
+        ordered = sorted(entries, key=lambda k: ranks[k])
+        edge_ids = [snapshot.edge_ids[adjacency.edges[k]] for k in ordered]
+        assert edge_ids == [e.id for e in sub.getInOutEdges(n)]
+
+
+def test_write_values():
+    G, sub = subgraph_with_holes()
+    snapshot = GraphSnapshot(sub)
+    node_values = G.getDoubleProperty("node_values")
+    edge_values = G.getIntegerProperty("edge_values")
+    snapshot.write_node_values(node_values, np.arange(snapshot.nb_nodes) * 0.5)
+    snapshot.write_edge_values("edge_values", np.arange(snapshot.nb_edges) + 1)
+    assert [node_values[n] for n in sub.nodes()] == [0.0, 0.5, 1.0, 1.5, 2.0]
+    assert [edge_values[e] for e in sub.edges()] == list(
+        range(1, snapshot.nb_edges + 1)
+    )
+    # nodes and edges out of the subgraph are left untouched
+    assert node_values[G.nodes()[0]] == 0.0
+    assert edge_values[G.existEdge(G.nodes()[2], G.nodes()[5])] == 0
+    # and values read back in position order
+    other = GraphSnapshot(sub, ["node_values"], [edge_values])
+    assert list(other.node_columns["node_values"]) == [0.0, 0.5, 1.0, 1.5, 2.0]
+    assert list(other.edge_column("edge_values")) == list(
+        range(1, snapshot.nb_edges + 1)
+    )
@@ -0,0 +1,49 @@
+import numpy as np
+from tulip import tlp
+
+from iGraphConverter import iGraphConverter
+
+
+def test_converter():
+    G = tlp.newGraph()
+    nodes = G.addNodes(8)
+    for u, v in [
+        (0, 1),
+        (1, 2),
+        (2, 0),
+        (1, 2),
+        (2, 1),
+        (3, 4),
+        (4, 5),
+        (5, 3),
+        (6, 6),
+    ]:
+        G.addEdge(nodes[u], nodes[v])
+    G.delNode(nodes[0])
+    weight = G.getDoubleProperty("weight")
+    label = G.getStringProperty("label")
+    for i, e in enumerate(G.edges()):
+        weight[e] = 0.5 * i
+    for n in G.nodes():
+        label[n] = "n%d" % n.id
+    converter = iGraphConverter(G)
+    snapshot = converter.snapshot
+    i_graph = converter.to_igraph(["label"], ["weight"])
+    assert i_graph.vcount() == G.numberOfNodes()
+    assert i_graph.ecount() == G.numberOfEdges()
+    # vertices and edges are aligned with snapshot positions, multiple edges included
+    for k, e in enumerate(G.edges()):
+        edge = i_graph.es[k]
+        assert edge.tuple == (
+            snapshot.node_position(G.source(e)),
+            snapshot.node_position(G.target(e)),
+        )
+        assert edge["weight"] == weight[e]
+    for n in G.nodes():
+        assert i_graph.vs[converter.node_index(n)]["label"] == label[n]
+    # the graph is built once
+    assert converter.to_igraph(["label"], ["weight"]) is i_graph
+    membership = G.getIntegerProperty("membership")
+    converter.write_membership(membership, np.arange(i_graph.vcount()) % 3)
+    for n in G.nodes():
+        assert membership[n] == converter.node_index(n) % 3
@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+
+import LeidenTrials as trials_module
+from CoMembership import CoMembership
+from LeidenTrials import LeidenTrials
+
+
+def random_edges(nb_nodes, nb_edges, seed):
+    rnd = random.Random(seed)
+    edges = [rnd.sample(range(nb_nodes), 2) for i in range(nb_edges)]
+    return np.array(edges, dtype=np.int64).T
+
+
+def community_sizes(membership):
+    return np.bincount(membership)[membership]
+
+
+def test_trials_do_not_depend_on_workers():
+    sources, targets = random_edges(80, 240, 1)
+    runs = []
+    for nb_workers in (1, 2):
+        trials = LeidenTrials(
+            80, sources, targets, nb_workers, seed=7, collect_statistics=True
+        )
+        # community sizes as the trial result
+        runs.append((list(trials.run(6, np.bincount)), trials.statistics_columns()))
+    (sequential, statistics), (parallel, parallel_statistics) = runs
+    assert len(sequential) == len(parallel) == 6
+    for (membership, sizes), (other_membership, other_sizes) in zip(
+        sequential, parallel
+    ):
+        assert np.array_equal(membership, other_membership)
+        assert np.array_equal(sizes, other_sizes)
+    for key in ("seed", "modularity", "nb_communities"):
+        assert statistics[key] == parallel_statistics[key]
+    # trials differ from each other
+    assert len(set(statistics["seed"])) == 6
+
+
+def test_node_scores(monkeypatch):
+    sources, targets = random_edges(60, 150, 2)
+    runs = list(LeidenTrials(60, sources, targets, seed=3).run(5, np.bincount))
+    # community sizes of nodes as their scores
+    expected = np.mean([sizes[membership] for membership, sizes in runs], axis=0)
+    membership, scores, co_membership = LeidenTrials(
+        60, sources, targets, seed=3
+    ).node_scores(5, community_sizes)
+    assert np.allclose(scores, expected) and co_membership is None
+    assert np.array_equal(membership, runs[-1][0])
+    # in consensus mode, trials run without scoring function nor arguments
+    shipped = []
+    init_worker = trials_module._init_worker_
+    monkeypatch.setattr(
+        trials_module,
+        "_init_worker_",
+        lambda *initargs: (shipped.append(initargs[3:5]), init_worker(*initargs)),
+    )
+    expected = CoMembership(60, sources, targets)
+    for membership, _ in runs:
+        expected.add(membership)
+    membership, scores, co_membership = LeidenTrials(
+        60, sources, targets, seed=3
+    ).node_scores(5, community_sizes, (), True, 0.6)
+    assert shipped == [(None, ())]
+    assert np.array_equal(co_membership.counts, expected.counts)
+    assert np.array_equal(membership, expected.consensus(0.6))
+    assert np.array_equal(scores, community_sizes(membership))
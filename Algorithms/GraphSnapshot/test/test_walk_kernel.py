@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from tulip import tlp
+
+from GraphSnapshot import GraphSnapshot
+from WalkKernel import WalkKernel, walk_steps
+
+
+def star_and_path():
+    """
+    star (center 0, leaves 1 to 4, a loop and a multiple edge on leaf 4),
+    path 5 - 6 - 7, and an isolated node 8
+    """
+    G = tlp.newGraph()
+    nodes = G.addNodes(9)
+    for i in range(1, 5):
+        G.addEdge(nodes[0], nodes[i])
+    G.addEdge(nodes[4], nodes[0])
+    G.addEdge(nodes[4], nodes[4])
+    G.addEdge(nodes[5], nodes[6])
+    G.addEdge(nodes[6], nodes[7])
+    weight = G.getDoubleProperty("weight")
+    for i, e in enumerate(G.edges()):
+        weight[e] = i + 1
+    return G, GraphSnapshot(G, edge_properties=[weight])
+
+
+def compile_kernel(snapshot, kernel):
+    adjacency = snapshot.adjacency
+    return kernel.compile(adjacency.indptr, adjacency.indices, adjacency.edges)
+
+
+def table_transitions(compiled, start):
+    """
+    transition matrix of a walk counting stays, read from the compiled tables
+    """
+    n = compiled.nb_nodes
+    P = np.zeros((n, n))
+    restart_nodes = (
+        [start] if compiled.restart_nodes is None else compiled.restart_nodes
+    )
+    can_restart = compiled.restart > 0 and any(
+        compiled.degree[r] > 0 for r in restart_nodes
+    )
+    move = 1.0 - compiled.restart - compiled.laziness
+    for u in range(n):
+        P[u, u] += compiled.laziness
+        for r in restart_nodes:
+            P[u, r] += compiled.restart / len(restart_nodes)
+        if compiled.degree[u] == 0:
+            if can_restart:
+                for r in restart_nodes:
+                    P[u, r] += move / len(restart_nodes)
+            else:
+                P[u, u] += move
+            continue
+        for e in range(compiled.indptr[u], compiled.indptr[u + 1]):
+            if compiled.cumulative is None:
+                p = 1.0 / compiled.degree[u]
+            else:
+                low = (
+                    compiled.cumulative[e - 1]
+                    if e > compiled.indptr[u]
+                    else compiled.row_base[u]
+                )
+                p = (compiled.cumulative[e] - low) / compiled.row_weight[u]
+            if compiled.accept is not None:
+                P[u, u] += move * p * (1 - compiled.accept[e])
+                p *= compiled.accept[e]
+            P[u, compiled.indices[e]] += move * p
+    return P
+
+
+def walked_transitions(compiled, start, nb_ticks, seed):
+    n = compiled.nb_nodes
+    trajectory = np.concatenate(
+        [[start]]
+        + list(walk_steps(compiled, start, nb_ticks, np.random.default_rng(seed), 1000))
+    )
+    counts = np.zeros((n, n))
+    np.add.at(counts, (trajectory[:-1], trajectory[1:]), 1)
+    visited = counts.sum(axis=1) > 0
+    counts[visited] /= counts[visited].sum(axis=1, keepdims=True)
+    return counts, visited
+
+
+@pytest.mark.parametrize(
+    "kernel",
+    [
+        WalkKernel(),
+        WalkKernel("metropolis"),
+        WalkKernel("weighted", weights=np.arange(1.0, 9.0)),
+        WalkKernel(laziness=0.3),
+        WalkKernel("metropolis", laziness=0.2, restart=0.1),
+        WalkKernel(
+            "weighted", weights=np.arange(1.0, 9.0), restart=0.2, restart_nodes=[0, 5]
+        ),
+    ],
+)
+def test_transition_frequencies(kernel):
+    G, snapshot = star_and_path()
+    compiled = compile_kernel(snapshot, kernel)
+    expected = table_transitions(compiled, 0)
+    assert np.allclose(expected.sum(axis=1), 1.0)
+    walked, visited = walked_transitions(compiled, 0, 200000, 1)
+    assert np.abs(walked - expected)[visited].max() < 0.02
+
+
+def test_weighted_tables():
+    G, snapshot = star_and_path()
+    compiled = compile_kernel(
+        snapshot,
+        WalkKernel("weighted", weights=snapshot.edge_column("weight", dtype=float)),
+    )
+    P = table_transitions(compiled, 0)
+    # the center reaches leaf 4 through two edges, of weights 4 and 5
+    assert np.allclose(P[0, 1:5], np.array([1, 2, 3, 9]) / 15.0)
+    # both entries of the loop (weight 6) keep the walk on leaf 4
+    assert np.allclose(P[4, [0, 4]], [9 / 21.0, 12 / 21.0])
+
+
+def test_count_stays():
+    G, snapshot = star_and_path()
+    kernel = WalkKernel("metropolis", laziness=0.5, count_stays=False)
+    compiled = compile_kernel(snapshot, kernel)
+    trajectory = np.concatenate(
+        list(walk_steps(compiled, 0, 50000, np.random.default_rng(2)))
+    )
+    assert len(trajectory) == 50000
+    # every tick is a move, to a node of the star
+    assert (trajectory[1:] != trajectory[:-1]).all() and trajectory.max() <= 4
+    # moves from the center follow the jump chain of the kernel
+    P = table_transitions(compiled, 0)
+    jump = P[0, 1:5] / P[0, 1:5].sum()
+    moves = trajectory[1:][trajectory[:-1] == 0]
+    assert np.abs(np.bincount(moves, minlength=5)[1:] / len(moves) - jump).max() < 0.02
+
+
+def test_isolated_start():
+    G, snapshot = star_and_path()
+    rng = np.random.default_rng(3)
+    # without restart, a walk from an isolated node stays there, or cannot tick at all
+    compiled = compile_kernel(snapshot, WalkKernel())
+    assert list(np.concatenate(list(walk_steps(compiled, 8, 5, rng)))) == [8] * 5
+    compiled = compile_kernel(snapshot, WalkKernel(count_stays=False))
+    assert list(walk_steps(compiled, 8, 5, rng)) == []
+    # restarting from the isolated node is no way out either
+    compiled = compile_kernel(snapshot, WalkKernel(restart=0.1, count_stays=False))
+    assert list(walk_steps(compiled, 8, 5, rng)) == []
+    # a restart node with neighbors is jumped to at once
+    for seed in range(20):
+        compiled = compile_kernel(snapshot, WalkKernel(restart=0.1, restart_nodes=[6]))
+        first = next(walk_steps(compiled, 8, 5, np.random.default_rng(seed)))
+        assert first[0] == 6 and 8 not in first
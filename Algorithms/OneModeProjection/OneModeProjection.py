@@ -1,5 +1,7 @@
 from tulip import *
 import tulipplugins
+import numpy as np
+from GraphSnapshot import GraphSnapshot
 
 def printit(f):
     def printed(*args, **kw):
@@ -51,23 +53,31 @@ class OneModeProjection(object):
 
 	@printit
 	def project(self):
-		catalysts = [n for n in self.two_mode_graph.getNodes() if self.entity_type[n] != self.substrates_name]
-		for c in catalysts:
+		'''
+		Substrate pairs sharing a catalyst are read from an array snapshot of the two mode graph,
+		weights are accumulated per pair and projected edges are then added at once.
+		'''
+		snapshot = GraphSnapshot(self.two_mode_graph)
+		adjacency = snapshot.adjacency
+		pairs = []
+		weights = []
+		for c in [n for n in snapshot.nodes if self.entity_type[n] != self.substrates_name]:
 			try:
 				c_weight = self.weight_function(c)
-				substrates = [neigh for neigh in self.two_mode_graph.getInOutNodes(c)]
-				for i, si in enumerate(substrates):
-					for j, sj in enumerate(substrates):
-						if i < j:
-							try:
-								e = self.substrate_graph.existEdge(si, sj, False)
-								if not e.isValid():
-									e = self.substrate_graph.addEdge(si, sj)
-								self.edge_weight[e] += c_weight
-							except ZeroDivisionError: # happens when c has degree 1, in which case there are no inferred edges
-								pass
-			except Exception:
-				print(self.graph['viewLabel'][si], self.graph['viewLabel'][sj])
+			except ZeroDivisionError: # happens when c has degree 1, in which case there are no inferred edges
+				continue
+			substrates = adjacency.neighbors(snapshot.node_position(c))
+			i, j = np.triu_indices(len(substrates), 1)
+			pairs.append(np.stack([substrates[i], substrates[j]], axis=1))
+			weights.append(np.full(len(i), c_weight))
+		if len(pairs) == 0:
+			return
+		pairs = np.sort(np.concatenate(pairs), axis=1)
+		pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+		pair_weights = np.bincount(inverse.ravel(), weights=np.concatenate(weights))
+		edges = self.substrate_graph.addEdges([(snapshot.nodes[si], snapshot.nodes[sj]) for si, sj in pairs.tolist()])
+		for e, w in zip(edges, pair_weights.tolist()):
+			self.edge_weight[e] += w
 
 	@printit
 	def Giatsidis_weight_function(self, catalyst):
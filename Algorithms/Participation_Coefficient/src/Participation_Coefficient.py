@@ -4,65 +4,97 @@
 
 from tulip import tlp
 import tulipplugins
-import igraph
-import networkx as nx
 import leidenalg
+import numpy as np
+from GraphSnapshot import GraphSnapshot
+from LeidenTrials import LeidenTrials
+from iGraphConverter import iGraphConverter
 
-class iGraphConverter():
-	'''
-	Utility class to convert grpahs between formats,
-	baiscally Tulip and iGraph
-	(used by the iGrpah implementation of the Leiden algorithm)
-	'''
-	def __init__(self, tulip_graph):
-		super(iGraphConverter, self).__init__()
-		self.tulip_graph = tulip_graph
-		tulip_nodes = [n for n in self.tulip_graph.getNodes()]
-		tulip_edges = [e for e in self.tulip_graph.getEdges()]
-		self.node_to_index = {tulip_nodes[i]: i for i in range(self.tulip_graph.numberOfNodes())}
-		self.index_to_node = {i: tulip_nodes[i] for i in range(self.tulip_graph.numberOfNodes())}
-		self.edge_to_index = {e: self._edge_index_(e) for e in tulip_edges}
-		self.index_to_edge = {}
-		for tulip_edge, edge_index in self.edge_to_index.items():
-			self.index_to_edge[edge_index] = tulip_edge
-
-	def _edge_index_(self, tulip_edge):
-		s = self.tulip_graph.source(tulip_edge)
-		t = self.tulip_graph.target(tulip_edge)
-		i = self.node_to_index[s]
-		j = self.node_to_index[t]
-		return i * self.tulip_graph.numberOfNodes() + j
-
-	def to_igraph(self, exported_node_properties = [], exported_edge_properties = []):
-		nb_vertices = self.tulip_graph.numberOfNodes()
-		edges = [(self.node_to_index[self.tulip_graph.source(e)], self.node_to_index[self.tulip_graph.target(e)]) for e in self.tulip_graph.getEdges()]
-		iG = igraph.Graph(nb_vertices)
-		iG = igraph.Graph.as_directed(iG, 'random')
-		iG.add_edges(edges)
-		for p in exported_node_properties:
-			self.write_node_property(iG, p)
-		for p in exported_edge_properties:
-			self.write_edge_property(iG, p)
-		return iG
-
-	def write_node_property(self, i_graph, property_name):
-		values = []
-		#for i in range(self.tulip_graph.numberOfNodes():
-		# tulip_node_from_index = self.index_to_node[i]
-		# property_value = self.tulip_graph[property_name]
-		i_graph.vs[property_name] = [self.tulip_graph[property_name][self.index_to_node[i]] for i in range(self.tulip_graph.numberOfNodes())]
-
-	# edge in igraph, index of source and target in igraph, convert to unique integer
-	# use map integer -> edge in tulip graph
-	def write_edge_property(self, i_graph, property_name):
-		property_values = []
-		for e in i_graph.es:
-			i = e.source
-			j = e.target
-			edge_index = i * self.tulip_graph.numberOfNodes() + j
-			e_tulip = self.index_to_edge[edge_index]
-			property_values.append(self.tulip_graph[property_name][e_tulip])
-		i_graph.es[property_name] = property_values
+
+# bounds of Guimera & Amaral roles: hubs have a within module degree z-score of at least
+# HUB_Z_SCORE, roles R1 to R4 (non hubs) and R5 to R7 (hubs) are then split by the
+# upper bounds of their participation coefficient
+HUB_Z_SCORE = 2.5
+NON_HUB_BOUNDS = [0.05, 0.62, 0.80]
+HUB_BOUNDS = [0.30, 0.75]
+
+
+def _community_strengths_(membership, indptr, indices, weights=None):
+    """
+    accumulates, in one pass over a CSR adjacency, the number (or total weight) of links
+    of each node to each community it reaches, returns the (node, community, strength)
+    arrays listing the pairs actually met, together with the degree (or strength) of nodes
+    """
+    nb_nodes = len(indptr) - 1
+    nb_communities = int(membership.max(initial=-1) + 1)
+    owners = np.repeat(np.arange(nb_nodes), np.diff(indptr))
+    strength = np.bincount(owners, weights=weights, minlength=nb_nodes).astype(float)
+    # sparse (node, community) strengths: only pairs actually met are stored
+    pairs, pair_index = np.unique(owners * nb_communities + membership[indices], return_inverse=True)
+    pair_strength = np.bincount(pair_index, weights=weights, minlength=len(pairs)).astype(float)
+    return pairs // nb_communities, pairs % nb_communities, pair_strength, strength
+
+
+def participation_coefficients(membership, indptr, indices, weights=None):
+    """
+    computes the participation coefficient of all nodes, given the community membership
+    of nodes and a CSR adjacency of the graph (undirected, or restricted to in or out
+    neighbors), with optional edge weights aligned with indices
+
+    the number (or total weight) k_is of links of node i to community s is accumulated
+    over (node, neighbor community) pairs in one pass over the adjacency, the coefficient
+    1 - sum_s (k_is / k_i) ** 2 is then computed for all nodes at once, k_i being the
+    degree (or strength) of i (0 for isolated nodes)
+
+    this is the per trial function run by the Leiden trials (possibly in worker processes)
+    """
+    membership = np.asarray(membership, dtype=np.int64)
+    nodes, _, pair_strength, strength = _community_strengths_(membership, indptr, indices, weights)
+    squares = np.bincount(nodes, weights=pair_strength ** 2, minlength=len(strength))
+    result = np.zeros(len(strength))
+    connected = strength > 0
+    result[connected] = 1 - squares[connected] / strength[connected] ** 2
+    return result
+
+
+def cartography(membership, indptr, indices, weights=None):
+    """
+    computes both the participation coefficient and the within module degree z-score
+    of all nodes from the same (node, community) strengths, returned as the rows of a
+    (2, n) array
+
+    the z-score of node i in community s is (k_i,s - mean_s) / std_s, mean and standard
+    deviation of the within module degree (or strength) being taken over nodes of s
+    (the z-score is 0 in communities where all nodes have the same within module degree)
+    """
+    membership = np.asarray(membership, dtype=np.int64)
+    nodes, communities, pair_strength, strength = _community_strengths_(membership, indptr, indices, weights)
+    nb_nodes = len(strength)
+    squares = np.bincount(nodes, weights=pair_strength ** 2, minlength=nb_nodes)
+    result = np.zeros((2, nb_nodes))
+    connected = strength > 0
+    result[0, connected] = 1 - squares[connected] / strength[connected] ** 2
+    internal = communities == membership[nodes]
+    within = np.zeros(nb_nodes)
+    within[nodes[internal]] = pair_strength[internal]
+    sizes = np.bincount(membership)
+    mean = np.bincount(membership, weights=within) / sizes
+    std = np.sqrt(np.maximum(np.bincount(membership, weights=within ** 2) / sizes - mean ** 2, 0))
+    spread = std[membership] > 0
+    result[1, spread] = (within[spread] - mean[membership][spread]) / std[membership][spread]
+    return result
+
+
+def roles(participation, z_score):
+    """
+    role of nodes in Guimera & Amaral cartography, as integers 1 to 7 (R1 to R7):
+    ultra-peripheral, peripheral, connector and kinless non hubs,
+    provincial, connector and kinless hubs
+    """
+    participation = np.asarray(participation)
+    non_hub_roles = 1 + np.searchsorted(NON_HUB_BOUNDS, participation, side='left')
+    hub_roles = 5 + np.searchsorted(HUB_BOUNDS, participation, side='left')
+    return np.where(np.asarray(z_score) >= HUB_Z_SCORE, hub_roles, non_hub_roles)
 
 class ParticipationCoefficient(tlp.DoubleAlgorithm):
     """
@@ -88,14 +120,21 @@ class ParticipationCoefficient(tlp.DoubleAlgorithm):
         self.addIntegerPropertyParameter('communities', help='Integer property holding commmunity membership of nodes', defaultValue='', isMandatory=True, inParam=True, outParam=False, valuesDescription  ='Integer property holding commmunity membership of nodes')
         self.addIntegerParameter('nb iterations', help='Number of trials (community detection runs)', defaultValue='50', isMandatory=True, inParam=True, outParam=False, valuesDescription  ='Number of trials (community detection runs)')
         self.addDoublePropertyParameter('result', help='Double property holding the resulting coefficient', defaultValue='', isMandatory=True, inParam=True, outParam=False, valuesDescription  ='Participation coefficient of nodes')
+        self.addIntegerParameter('nb workers', help='Number of processes running the community detection trials (1 runs them within Tulip)', defaultValue='1', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Number of worker processes')
+        self.addIntegerParameter('seed', help='Seed from which the seeds of trials are derived (-1 for a random seed)', defaultValue='-1', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Seed of the community detection trials')
+        self.addDoublePropertyParameter('edge weight', help='Double property holding edge weights (unweighted coefficient when left empty)', defaultValue='', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Edge weights (strength based coefficient)')
+        self.addBooleanParameter('cartography', help='Also computes the within module degree z-score of nodes (within_module_degree property) and their role R1 to R7 (role property)', defaultValue='False', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Computes the Guimera & Amaral roles of nodes')
+        self.addBooleanParameter('trial statistics', help='Stores the modularity, number of communities and timings of each trial as graph attributes (trial_modularity, trial_nb_communities, ...)', defaultValue='False', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Collects statistics of trials')
+        self.addBooleanParameter('consensus', help='Computes coefficients once, on the consensus partition of trials (nodes linked by an edge falling within a community in most trials are kept together), the co-clustering frequency of edges is stored in the co_clustering property', defaultValue='False', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Compute coefficients on the consensus partition')
+        self.addFloatParameter('consensus threshold', help='Fraction of trials in which the ends of an edge must share a community for the edge to be kept in the consensus partition', defaultValue='0.5', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Co-clustering threshold of the consensus partition')
+        self.addStringCollectionParameter('direction', help='Links accounted for: all (edge direction is ignored), in (in-strength) or out (out-strength) links', defaultValue='all;in;out', isMandatory=False, inParam=True, outParam=False, valuesDescription  ='Direction of links')
 
     def participation_coefficient(self, node):
-        self.nb_communities = int(self.community_property.getNodeMax() + 1)
-        distrib = [0 for i in range(self.nb_communities)]
-        for neigh in self.graph.getInOutNodes(node):
-            distrib[int(self.community_property[neigh])] += 1
-        d = sum(distrib)
-        return 1 - sum(list(map(lambda x: (x / d) ** 2, distrib)))
+        communities = [self.community_property[neigh] for neigh in self.graph.getInOutNodes(node)]
+        if len(communities) == 0:
+            return 0.0
+        _, distrib = np.unique(communities, return_counts=True)
+        return 1 - ((distrib / len(communities)) ** 2).sum()
 
     def check(self):
         # This method is called before applying the algorithm on the
@@ -110,27 +149,17 @@ class ParticipationCoefficient(tlp.DoubleAlgorithm):
 
     def run_community_finding_algorithm(self):
         """
-        Uses Leiden's (improvement over Louvain) implemented under igraph
+        Uses Leiden's (improvement over Louvain) implemented under igraph,
+        returns the number of communities and the modularity of the partition
+        (as computed by leidenalg)
         """
         gc = iGraphConverter(self.graph)
         iG = gc.to_igraph()
         communities = leidenalg.find_partition(
             iG, leidenalg.ModularityVertexPartition
         )
-        node_partition = [set(communities[i]) for i in range(len(communities))]
-        try:
-            xG = nx.Graph()
-            xG.add_nodes_from([i for i in range(graph.numberOfNodes())])
-            xG.add_edges_from(iG.get_edgelist())
-            modularity = nx.community.modularity(nx.Graph(iG.get_edgelist()), node_partition)
-        except nx.algorithms.community.quality.NotAPartition as e:
-            if not tlp.ConnectedTest.isConnected(self.graph):
-                print(f'Graph is not connected')
-                raise e
-        membership = communities.membership
-        for n in self.graph.getNodes():
-            self.community_property[n] = membership[gc.node_to_index[n]]
-        return len(communities), modularity
+        gc.write_membership(self.community_property, communities.membership)
+        return len(communities), communities.modularity
 
     def run(self):
         # This method is the entry point of the algorithm when it is called
@@ -151,13 +180,41 @@ class ParticipationCoefficient(tlp.DoubleAlgorithm):
         self.community_property = self.dataSet['communities']
         nb_iterations = self.dataSet['nb iterations']
         part_coeff = self.dataSet["result"]
-        part_coeff.setAllNodeValue(0.0)
-        for k in range(nb_iterations):
-            self.run_community_finding_algorithm()
-            for node in self.graph.getNodes():
-                part_coeff[node] += self.participation_coefficient(node)
-        for node in self.graph.getNodes():
-            part_coeff[node] /= nb_iterations
+        nb_workers = self.dataSet['nb workers']
+        seed = self.dataSet['seed']
+        snapshot = GraphSnapshot(self.graph)
+        if self.dataSet['direction'] == 'in':
+            adjacency = snapshot.in_adjacency
+        elif self.dataSet['direction'] == 'out':
+            adjacency = snapshot.out_adjacency
+        else: # self.dataSet['direction'] == 'all'
+            adjacency = snapshot.adjacency
+        weights = None
+        if self.dataSet['edge weight'] is not None:
+            weights = snapshot.edge_column(self.dataSet['edge weight'], dtype=float)[adjacency.edges]
+        # the cartography (coefficient and within module degree z-score) costs the same
+        # single pass over the adjacency as the coefficient alone
+        trial_function = cartography if self.dataSet['cartography'] else participation_coefficients
+        # trials (Leiden run and coefficients) are dispatched to worker processes
+        # when asked to, the adjacency (and edge weights) are shipped once to each of them
+        trials = LeidenTrials.from_snapshot(snapshot, nb_workers, None if seed < 0 else seed, self.dataSet['trial statistics'])
+        trial_arguments = (adjacency.indptr, adjacency.indices, weights)
+        # coefficients are averaged over trials, or in consensus mode, computed once
+        # on the consensus partition of trials
+        membership, scores, co_membership = trials.node_scores(nb_iterations, trial_function, trial_arguments, self.dataSet['consensus'], self.dataSet['consensus threshold'])
+        if co_membership is not None:
+            snapshot.write_edge_values(self.graph.getDoubleProperty('co_clustering'), co_membership.frequencies())
+        # communities property holds the consensus partition,
+        # or the partition found by the last trial
+        snapshot.write_node_values(self.community_property, membership)
+        for name, values in trials.statistics_columns().items():
+            self.graph.setAttribute('trial_' + name, values)
+        if self.dataSet['cartography']:
+            # roles are given by the coefficient and z-score averaged over trials (or on the consensus)
+            snapshot.write_node_values(self.graph.getDoubleProperty('within_module_degree'), scores[1])
+            snapshot.write_node_values(self.graph.getStringProperty('role'), ['R%d' % r for r in roles(scores[0], scores[1])])
+            scores = scores[0]
+        snapshot.write_node_values(part_coeff, scores)
         return True
 
 # The line below does the magic to register the plugin into the plugin database
@@ -29,3 +29,58 @@ def test_plugin():
     
     assert (int(particip[nodes[2]] * 100)/100 == 0.44)
     assert (int(particip[nodes[3]] * 100)/100 == 0.44)
+
+def test_weighted_directed():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(4)]
+    weight = G.getDoubleProperty('weight')
+    # node 0 points to 1 and 2 (weight 3 and 1) and receives from 3
+    for i, j, w in [(0, 1, 3.0), (0, 2, 1.0), (3, 0, 2.0)]:
+        weight[G.addEdge(nodes[i], nodes[j])] = w
+    membership = np.array([0, 0, 1, 1])
+
+    snapshot = GraphSnapshot(G)
+    out_adjacency = snapshot.out_adjacency
+    weights = snapshot.edge_column(weight)[out_adjacency.edges]
+    coefficients = participation_coefficients(membership, out_adjacency.indptr, out_adjacency.indices, weights)
+    assert coefficients[0] == 1 - (3 / 4) ** 2 - (1 / 4) ** 2
+    assert coefficients[1] == 0.0
+
+    adjacency = snapshot.adjacency
+    weights = snapshot.edge_column(weight)[adjacency.edges]
+    coefficients = participation_coefficients(membership, adjacency.indptr, adjacency.indices, weights)
+    assert abs(coefficients[0] - (1 - (3 / 6) ** 2 - (3 / 6) ** 2)) < 1e-12
+
+def test_cartography():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(6)]
+    # two triangles bridged by the 2 - 3 edge
+    for i, j in [(0, 1), (0, 2), (1, 2), (3, 4), (3, 5), (4, 5), (2, 3)]:
+        G.addEdge(nodes[i], nodes[j])
+    membership = np.array([0, 0, 0, 1, 1, 1])
+
+    adjacency = GraphSnapshot(G).adjacency
+    participation, z_score = cartography(membership, adjacency.indptr, adjacency.indices)
+    assert list(participation) == list(participation_coefficients(membership, adjacency.indptr, adjacency.indices))
+    # every node has 2 neighbors in its own community
+    assert list(z_score) == [0.0] * 6
+    assert list(roles(participation, z_score)) == [1, 1, 2, 2, 1, 1]
+    assert list(roles([0.2, 0.7, 0.9], [3.0, 3.0, 3.0])) == [5, 6, 7]
+
+def test_consensus():
+    G = tlp.newGraph()
+    nodes = [G.addNode() for i in range(6)]
+    for i, j in [(0, 1), (0, 2), (1, 2), (3, 4), (3, 5), (4, 5), (2, 3)]:
+        G.addEdge(nodes[i], nodes[j])
+
+    community = G.getIntegerProperty('community')
+    particip = G.getDoubleProperty('participation')
+    params = tlp.getDefaultPluginParameters('Participation Coefficient', G)
+    params['communities'] = community
+    params['result'] = particip
+    params['nb iterations'] = 5
+    params['consensus'] = True
+    G.applyDoubleAlgorithm('Participation Coefficient', particip, params)
+
+    assert [community[n] for n in nodes] == [0, 0, 0, 1, 1, 1]
+    assert [int(particip[n] * 100) / 100 for n in nodes] == [0.0, 0.0, 0.44, 0.44, 0.0, 0.0]
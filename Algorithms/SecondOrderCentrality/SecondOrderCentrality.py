@@ -2,57 +2,282 @@
 # -*- coding:utf-8 -*-
 
 from tulip import *
-from random import *
-from math import *
+import multiprocessing
+import numpy as np
+from GraphSnapshot import GraphSnapshot
+from WalkKernel import WalkKernel, walk_steps, BATCH_SIZE
+
+# graphs up to this number of nodes get their exact centrality rather than a walk
+EXACT_THRESHOLD = 2000
+
+# above this fraction of nonzero entries, LU factors are no better than a dense inverse
+DENSE_FILL = 0.05
+
+def metropolisMoves(indptr, indices, start, nbMoves, rng, batchSize=BATCH_SIZE):
+    '''
+    runs a Metropolis walk (uniform stationary distribution) over a CSR adjacency
+    (see GraphSnapshot): a neighbor v of the active node u is drawn uniformly at random
+    and the walk moves to v with probability min(1, deg(u) / deg(v))
+
+    the walk goes on until it has moved nbMoves times (staying on a node does not count),
+    the trajectory (node reached by each move) is yielded by chunks of at most batchSize moves
+    (the walk is run by the shared stepping core, see WalkKernel)
+    '''
+    compiled = WalkKernel.metropolis().compile(indptr, indices)
+    return walk_steps(compiled, start, nbMoves, rng, batchSize)
+
+def metropolisWalk(indptr, indices, start, nbMoves, rng, batchSize=BATCH_SIZE):
+    '''
+    runs a Metropolis walk of nbMoves moves (see metropolisMoves) and returns the whole
+    trajectory, the k-th entry being the node reached by the k-th move,
+    that is the node visited at tick k
+    '''
+    chunks = list(metropolisMoves(indptr, indices, start, nbMoves, rng, batchSize))
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(chunks)
+
+def returnTimeStatistics(trajectory, nbNodes):
+    '''
+    computes the number, mean and standard deviation of return times of each node
+    from a trajectory (node visited at each tick)
+
+    ticks are grouped by node with a stable sort, return times are the differences
+    of consecutive ticks of a node (nodes visited less than twice get 0 for all three)
+    '''
+    ticks = np.argsort(trajectory, kind='stable')
+    visited = trajectory[ticks]
+    returns = visited[1:] == visited[:-1]
+    owners = visited[1:][returns]
+    gaps = np.diff(ticks)[returns].astype(float)
+    count = np.bincount(owners, minlength=nbNodes)
+    mean = np.zeros(nbNodes)
+    std = np.zeros(nbNodes)
+    returned = count > 0
+    mean[returned] = np.bincount(owners, weights=gaps, minlength=nbNodes)[returned] / count[returned]
+    deviations = np.bincount(owners, weights=(gaps - mean[owners]) ** 2, minlength=nbNodes)
+    std[returned] = np.sqrt(deviations[returned] / count[returned])
+    return count, mean, std
+
+def exactReturnTimeStatistics(indptr, indices, blockSize=256):
+    '''
+    computes the exact mean and standard deviation of return times of each node
+    for the walk run by metropolisMoves (ticks only counting actual moves), over a CSR adjacency
+
+    the walk is the jump chain of the Metropolis walk, P(u, v) being proportional to
+    mult(u, v) / max(deg(u), deg(v)); with Z = (I - P + 1 pi^T)^-1 its fundamental matrix
+    and pi its stationary distribution, return times to v have mean 1 / pi(v) and
+    second moment (2 Z(v, v) - pi(v)) / pi(v)^2 (Kemeny and Snell)
+
+    the diagonal of Z is derived from the inverse of I - P grounded at one node, whose
+    sparse LU factorization is solved for blockSize unit vectors at once (the grounded
+    matrix is inverted as a dense one when factors fill more than DENSE_FILL of it);
+    each connected component is solved on its own, isolated nodes get 0 (requires scipy)
+    '''
+    from scipy import sparse
+    from scipy.sparse import csgraph
+    from scipy.sparse.linalg import splu
+    nbNodes = len(indptr) - 1
+    deg = np.diff(indptr)
+    owners = np.repeat(np.arange(nbNodes), deg)
+    # loops only make the walk stay on its node
+    moves = owners != indices
+    rows = owners[moves]
+    cols = indices[moves]
+    # Metropolis transition probabilities (multiple edges are summed up)
+    metropolis = sparse.csr_matrix((1.0 / np.maximum(deg[rows], deg[cols]), (rows, cols)), shape=(nbNodes, nbNodes))
+    leave = np.asarray(metropolis.sum(axis=1)).ravel()
+    mean = np.zeros(nbNodes)
+    std = np.zeros(nbNodes)
+    _, labels = csgraph.connected_components(metropolis, directed=False)
+    for nodes in np.split(np.argsort(labels, kind='stable'), np.cumsum(np.bincount(labels))[:-1]):
+        k = len(nodes)
+        if k < 2:
+            continue
+        jump = sparse.diags(1.0 / leave[nodes]) @ metropolis[nodes][:, nodes]
+        # the Metropolis walk has a uniform stationary distribution,
+        # its jump chain one proportional to the probability of leaving nodes
+        pi = leave[nodes] / leave[nodes].sum()
+        grounded = sparse.csc_matrix((sparse.identity(k) - jump)[:-1, :-1])
+        factors = splu(grounded)
+        # G is the grounded inverse padded with zeros (last row and column)
+        rowSums = np.zeros(k)
+        weightedColumns = np.zeros(k)
+        diagonal = np.zeros(k)
+        if factors.L.nnz + factors.U.nnz > DENSE_FILL * (k - 1) ** 2:
+            inverse = np.linalg.inv(grounded.toarray())
+            rowSums[:-1] = inverse.sum(axis=1)
+            weightedColumns[:-1] = pi[:-1] @ inverse
+            diagonal[:-1] = np.diag(inverse)
+        else:
+            rowSums[:-1] = factors.solve(np.ones(k - 1))
+            weightedColumns[:-1] = factors.solve(pi[:-1], trans='T')
+            for start in range(0, k - 1, blockSize):
+                block = np.arange(start, min(start + blockSize, k - 1))
+                units = np.zeros((k - 1, len(block)))
+                units[block, np.arange(len(block))] = 1.0
+                diagonal[block] = factors.solve(units)[block, np.arange(len(block))]
+        # diagonal of the group inverse (I - 1 pi^T) G (I - 1 pi^T), plus pi for Z
+        fundamental = diagonal - pi * rowSums - weightedColumns + pi * (pi @ rowSums) + pi
+        mean[nodes] = 1.0 / pi
+        std[nodes] = np.sqrt(np.maximum(2 * fundamental - pi - 1, 0)) / pi
+    return mean, std
+
+class ReturnTimeAccumulator(object):
+    '''
+    streaming return time statistics: only the last visit tick, number of returns,
+    running mean and sum of squared deviations (M2) of return times of each node are kept,
+    so that memory stays linear in the number of nodes whatever the walk length
+
+    chunks of the trajectory are accounted for in turn (update), the statistics of the
+    return times within a chunk being merged into the running ones as in Welford's
+    online algorithm (pairwise update of Chan et al.)
+    '''
+    def __init__(self, nbNodes):
+        self.nbNodes = nbNodes
+        self.last = np.full(nbNodes, -1, dtype=np.int64)
+        self.count = np.zeros(nbNodes, dtype=np.int64)
+        self.mean = np.zeros(nbNodes)
+        self.m2 = np.zeros(nbNodes)
+        self.tick = 0
+
+    def update(self, trajectory):
+        '''
+        accounts for the next chunk of the trajectory (nodes visited from the current tick on)
+        '''
+        order = np.argsort(trajectory, kind='stable')
+        visited = trajectory[order]
+        ticks = self.tick + order
+        # a node first visited in the chunk returns from its last visit in previous chunks
+        first = np.ones(len(visited), dtype=bool)
+        first[1:] = visited[1:] != visited[:-1]
+        previous = np.empty(len(visited), dtype=np.int64)
+        previous[first] = self.last[visited[first]]
+        previous[~first] = ticks[:-1][~first[1:]]
+        returns = previous >= 0
+        owners = visited[returns]
+        gaps = (ticks - previous)[returns].astype(float)
+        count = np.bincount(owners, minlength=self.nbNodes)
+        returned = count > 0
+        mean = np.zeros(self.nbNodes)
+        mean[returned] = np.bincount(owners, weights=gaps, minlength=self.nbNodes)[returned] / count[returned]
+        m2 = np.bincount(owners, weights=(gaps - mean[owners]) ** 2, minlength=self.nbNodes)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean[returned] += delta[returned] * count[returned] / total[returned]
+        self.m2[returned] += m2[returned] + delta[returned] ** 2 * self.count[returned] * count[returned] / total[returned]
+        self.count = total
+        last = np.ones(len(visited), dtype=bool)
+        last[:-1] = first[1:]
+        self.last[visited[last]] = ticks[last]
+        self.tick += len(trajectory)
+
+    def statistics(self):
+        '''
+        number, mean and standard deviation of return times of each node
+        (same as returnTimeStatistics over the whole trajectory)
+        '''
+        std = np.zeros(self.nbNodes)
+        returned = self.count > 0
+        std[returned] = np.sqrt(self.m2[returned] / self.count[returned])
+        return self.count.copy(), self.mean.copy(), std
+
+    @staticmethod
+    def merge(accumulators):
+        '''
+        pools the return times accounted for by several accumulators (independent walks)
+        into a new accumulator, whose ticks no longer refer to any walk
+        '''
+        merged = ReturnTimeAccumulator(accumulators[0].nbNodes)
+        for accumulator in accumulators:
+            total = merged.count + accumulator.count
+            returned = accumulator.count > 0
+            delta = accumulator.mean[returned] - merged.mean[returned]
+            ratio = accumulator.count[returned] / total[returned]
+            merged.m2[returned] += accumulator.m2[returned] + delta ** 2 * merged.count[returned] * ratio
+            merged.mean[returned] += delta * ratio
+            merged.count = total
+            merged.tick += accumulator.tick
+        return merged
+
+class Walker(object):
+    '''
+    state of one of several independent walks: active node (position in the snapshot),
+    random generator and return time statistics, so that the walk can be resumed
+    round after round (possibly in another worker process)
+    '''
+    def __init__(self, position, rng, nbNodes):
+        self.position = position
+        self.rng = rng
+        self.accumulator = ReturnTimeAccumulator(nbNodes)
+
+    def walk(self, compiled, nbMoves):
+        for chunk in walk_steps(compiled, self.position, nbMoves, self.rng):
+            self.accumulator.update(chunk)
+            self.position = int(chunk[-1])
+        return self
+
+# state of a worker process, set once by _initWorker
+_worker = {}
+
+def _initWorker(compiled):
+    _worker['compiled'] = compiled
+
+def _walkRound(task):
+    walker, nbMoves = task
+    return walker.walk(_worker['compiled'], nbMoves)
 
 class RandomWalk(object):
     '''
     implements the core structure of a random walk
-    acts as a mother class for specialized subroutines
+    acts as a mother class for walk based measures
 
-    makes no special assumptions on the graph
-    the walk goes over
+    makes no special assumptions on the graph the walk goes over: the walk runs over
+    the arrays of a snapshot of the graph, steps being chosen according to a kernel
+    (see WalkKernel, a uniform walk by default) by the shared stepping core
     '''
-    def __init__(self, graph):
+    def __init__(self, graph, kernel=None, seed=None):
         super(RandomWalk, self).__init__()
         self.graph = graph
-        self.previousNode = None
+        self.snapshot = GraphSnapshot(graph)
+        self.kernel = WalkKernel() if kernel is None else kernel
+        # the seed also drives the choice of the initial node
+        self.rng = np.random.default_rng(seed)
+        self.compiled = None
         self.activeNode = None
-        self.previousNode = None
 
         self.selectInitNode()
         self.tick = 0
 
+    def compiledKernel(self):
+        '''
+        tables of the kernel over the (undirected) adjacency of the snapshot, compiled once
+        '''
+        if self.compiled is None:
+            adjacency = self.snapshot.adjacency
+            self.compiled = self.kernel.compile(adjacency.indptr, adjacency.indices, adjacency.edges)
+        return self.compiled
+
     def randomWalk(self, nbSteps):
         '''
     this is the core function inherited by subclasses
-    running the walk
+    running the walk for nbSteps ticks
 
-    should not be overriden, just use as is
-    uses all dependent sub-routines
+    nodes visited by the walk are handed over to account by chunks
         '''
-        stepper = self.randomStep()
-        while self.tick < nbSteps:
-            self.activeNode = stepper.send(None)
-            self.updateInfo()
-            self.previousNode = self.activeNode
-
-    def randomStep(self):
-        while True:
-            self.selectNeighbor()
-            yield self.activeNode
+        start = self.snapshot.node_position(self.activeNode)
+        for chunk in walk_steps(self.compiledKernel(), start, nbSteps, self.rng):
+            self.account(chunk)
+            self.tick += len(chunk)
+            self.activeNode = self.snapshot.nodes[chunk[-1]]
 
-    def updateInfo(self):
+    def account(self, trajectory):
         '''
-        updates a node's local information directly related
-        to what the walk is meant to compute
+        updates the information directly related to what the walk is meant to compute,
+        from a chunk of the trajectory (positions of the nodes visited at successive ticks)
         this method is a stub that sould be overriden
         by the subclass
-
-        note: updateInfo is responsible for managing ticks
-        as this may depend on the walk specificities
         '''
-        self.tick += 1
         return None
 
     def selectInitNode(self):
@@ -66,46 +291,125 @@ class RandomWalk(object):
         '''
         self.activeNode = self.graph.getOneNode()
 
-    def selectNeighbor(self):
-        '''
-        selects a neighbor of the active node
-        the node is chosen acccording to some process
-        that's specific to the subclass
-
-        this method is a stub that sould be overriden
-        by the subclass
-        '''
-        neighbors = [neigh for neigh in self.graph.getInOutNodes(self.activeNode) ]
-        self.activeNode = neighbors[randint(0, len(neighbors)-1)]
-
 class PlainWalk(RandomWalk):
     '''
-    Plain walk on a graph,  chossing neighbor uniformy at random
+    Plain walk on a graph,  chossing neighbor uniformy at random (unless another kernel is given)
     The walk obviously converges towards the degree of nodes
+    Visit counts are added to the freq property after each walk
     '''
-    def __init__(self, graph):
-        super(PlainWalk, self).__init__(graph)
+    def __init__(self, graph, kernel=None, seed=None):
+        super(PlainWalk, self).__init__(graph, kernel, seed)
         self.frequency = self.graph.getIntegerProperty('freq')
+        self.counts = np.zeros(self.snapshot.nb_nodes, dtype=np.int64)
+
+    def randomWalk(self, nbSteps):
+        super(PlainWalk, self).randomWalk(nbSteps)
+        self.snapshot.write_node_values(self.frequency, self.counts)
 
-    def updateInfo(self):
-        self.frequency[self.activeNode] += 1
+    def account(self, trajectory):
+        self.counts += np.bincount(trajectory, minlength=self.snapshot.nb_nodes)
 
 class SecondOrderCentrality(RandomWalk):
+    '''
+    estimates the second order centrality of nodes (standard deviation of the return
+    times of a Metropolis walk, whose stationary distribution is uniform)
 
-    def __init__(self, graph):
-        super(SecondOrderCentrality, self).__init__(graph)
-        self.nbSteps = 0
-        self.tickVector = self.graph.getIntegerVectorProperty('tickVector')
-
-    def updateInfo(self):
-        if self.activeNode != self.previousNode:
-            L = self.tickVector[self.activeNode]
-            L.append(self.tick)
-            self.tickVector[self.activeNode] = L
-            self.tick += 1
-        self.nbSteps += 1
-        if (self.nbSteps + 1) % 1000 == 0:
-            print('... step ', self.nbSteps + 1)        
+    the walk runs over the arrays of a snapshot of the graph (Metropolis kernel, see
+    WalkKernel), ticks of the walk being kept as a single trajectory array, or, in streaming mode,
+    accounted for chunk by chunk and dropped (see ReturnTimeAccumulator); multiWalk
+    pools the return times of several independent walks
+    '''
+    def __init__(self, graph, seed=None, streaming=False):
+        super(SecondOrderCentrality, self).__init__(graph, WalkKernel.metropolis(), seed)
+        self.streaming = streaming
+        self.trajectory = np.zeros(0, dtype=np.int64)
+        self.accumulator = ReturnTimeAccumulator(self.snapshot.nb_nodes)
+        self.exact = None
+
+    def randomWalk(self, nbSteps):
+        '''
+        walks until nbSteps moves have been made
+        '''
+        self.exact = None
+        self.tick = 0
+        self.accumulator = ReturnTimeAccumulator(self.snapshot.nb_nodes)
+        self.chunks = []
+        super(SecondOrderCentrality, self).randomWalk(nbSteps)
+        if self.streaming:
+            self.trajectory = None
+        else:
+            self.trajectory = np.concatenate(self.chunks) if len(self.chunks) > 0 else np.zeros(0, dtype=np.int64)
+        self.chunks = []
+
+    def account(self, trajectory):
+        if self.streaming:
+            self.accumulator.update(trajectory)
+        else:
+            self.chunks.append(trajectory)
+
+    def multiWalk(self, nbSteps, nbWalkers, nbWorkers=1, nbRounds=10, tolerance=0.0):
+        '''
+        splits nbSteps moves over nbWalkers independent walks started from nodes drawn
+        from the stationary (uniform) distribution, return times of all walks being pooled
+
+        walks run in nbRounds rounds (in a pool of nbWorkers processes, unless already
+        running in a worker process), statistics being merged after each round; when
+        tolerance is positive, walks stop as soon as a round changes the centrality vector
+        by less than tolerance (relative euclidean norm)
+
+        returns the number of rounds actually run (fewer than nbRounds when walks are too
+        short to be split in nbRounds, or stop early)
+        '''
+        if nbWalkers < 1 or nbRounds < 1:
+            raise ValueError('multiWalk needs at least one walker and one round')
+        compiled = self.compiledKernel()
+        nbNodes = self.snapshot.nb_nodes
+        seeds = np.random.SeedSequence(int(self.rng.integers(1 << 63))).spawn(nbWalkers)
+        starts = self.rng.integers(nbNodes, size=nbWalkers).tolist()
+        walkers = [Walker(start, np.random.default_rng(seed), nbNodes) for start, seed in zip(starts, seeds)]
+        # the first nbSteps % nbWalkers walkers make one more move, so that moves sum up to nbSteps
+        movesPerWalker = [nbSteps // nbWalkers + (i < nbSteps % nbWalkers) for i in range(nbWalkers)]
+        movesPerRound = -(-movesPerWalker[0] // nbRounds)
+        inWorker = multiprocessing.current_process().daemon
+        pool = None
+        if nbWorkers > 1 and nbWalkers > 1 and not inWorker:
+            pool = multiprocessing.Pool(min(nbWorkers, nbWalkers), _initWorker, (compiled,))
+        else:
+            _initWorker(compiled)
+        self.accumulator = ReturnTimeAccumulator(nbNodes)
+        previous = None
+        rounds = 0
+        try:
+            for r in range(nbRounds):
+                if r * movesPerRound >= movesPerWalker[0]:
+                    break
+                tasks = [(walker, max(0, min(movesPerRound, moves - r * movesPerRound))) for walker, moves in zip(walkers, movesPerWalker)]
+                walkers = pool.map(_walkRound, tasks) if pool is not None else list(map(_walkRound, tasks))
+                rounds += 1
+                self.accumulator = ReturnTimeAccumulator.merge([walker.accumulator for walker in walkers])
+                std = self.accumulator.statistics()[2]
+                if tolerance > 0 and previous is not None:
+                    if np.linalg.norm(std - previous) <= tolerance * np.linalg.norm(previous):
+                        break
+                previous = std
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.walkers = walkers
+        self.trajectory = None
+        self.exact = None
+        self.tick = self.accumulator.tick
+        return rounds
+
+    def exactCentrality(self):
+        '''
+        computes the exact centrality (see exactReturnTimeStatistics) instead of walking,
+        every connected component being accounted for (a walk stays in the component
+        of its initial node)
+        '''
+        adjacency = self.snapshot.adjacency
+        _, self.exact = exactReturnTimeStatistics(adjacency.indptr, adjacency.indices)
 
     def selectInitNode(self):
         '''
@@ -117,29 +421,31 @@ class SecondOrderCentrality(RandomWalk):
             if select[node]:
               self.activeNode = node
         if self.activeNode == None:
-            N = self.graph.numberOfNodes()
-            nodes = list(self.graph.getNodes())
-            self.activeNode = nodes[randint(0, N - 1)]
+            self.activeNode = self.snapshot.nodes[int(self.rng.integers(self.snapshot.nb_nodes))]
+
+    def centrality(self):
+        '''
+        standard deviation of return times of nodes, in snapshot node order
+        '''
+        if self.exact is not None:
+            return self.exact
+        if self.trajectory is None:
+            _, _, std = self.accumulator.statistics()
+        else:
+            _, _, std = returnTimeStatistics(self.trajectory, self.snapshot.nb_nodes)
+        return std
 
-    def selectNeighbor(self):
-        neighbors = list(self.graph.getInOutNodes(self.activeNode))
-        selectedNeighbor = neighbors[randint(0, len(neighbors)-1)]
-        ratio = float(self.graph.deg(self.activeNode)) / float(self.graph.deg(selectedNeighbor))
-        if random() < ratio:
-            self.activeNode = selectedNeighbor
+    def writeCentrality(self, property):
+        self.snapshot.write_node_values(property, self.centrality())
 
 def main(graph):
     print('Processing graph ' + graph.getName())
     soc = SecondOrderCentrality(graph)
-    print('Walking', 25*graph.numberOfEdges())
-    soc.randomWalk(25*graph.numberOfEdges())
-    property = graph.getDoubleProperty('+centrality')
-    print('Computing second order centrality')
-    for n in graph.getNodes():
-        V = graph['tickVector'][n]
-        L = V[0:len(V)-1]
-        LL = V[1:len(V)]
-        N = len(V)-1
-        mean = sum(map(lambda x: x[1]-x[0], zip(L, LL)))/N
-        stddev = sqrt(sum(map(lambda x: (x-mean)**2, map(lambda x: x[1]-x[0], zip(L, LL)))) / N)
-        property[n] = stddev
+    if graph.numberOfNodes() <= EXACT_THRESHOLD:
+        print('Computing exact second order centrality')
+        soc.exactCentrality()
+    else:
+        print('Walking', 25*graph.numberOfEdges())
+        soc.randomWalk(25*graph.numberOfEdges())
+        print('Computing second order centrality')
+    soc.writeCentrality(graph.getDoubleProperty('+centrality'))
@@ -0,0 +1,55 @@
+from tulip import *
+import tulipplugins
+from SecondOrderCentrality import SecondOrderCentrality, EXACT_THRESHOLD
+
+class SecondOrderCentralityPlugin(tlp.DoubleAlgorithm):
+    '''
+    Computes the second order centrality of nodes as defined in:
+    Kermarrec, A.-M., et al. (2011). Second order centrality: Distributed assessment of nodes criticity in complex networks.
+    Computer Communications 34(5): 619-628.
+
+    The centrality of a node is the standard deviation of the return times to the node
+    of a Metropolis random walk (see the SecondOrderCentrality class). The walk starts from
+    a selected node (viewSelection), or from a node chosen at random. Centrality of nodes of
+    small graphs is computed exactly, from the transition matrix of the walk.
+    '''
+
+    def __init__(self, context):
+        tlp.DoubleAlgorithm.__init__(self, context)
+        # you can add parameters to the plugin here through the following syntax
+        # self.add<Type>Parameter("<paramName>", "<paramDoc>", "<paramDefaultValue>")
+        # (see documentation of class tlp.WithParameter to see what types of parameters are supported)
+        self.addIntegerParameter("Walk length", "Number of moves of the walk, per edge of the graph", "25")
+        self.addIntegerParameter("Seed", "Seed of the walk (-1 for a random seed)", "-1")
+        self.addBooleanParameter("Streaming", "Keeps running return time statistics (memory linear in the number of nodes) rather than the whole trajectory of the walk", "False")
+        self.addIntegerParameter("Walkers", "Number of independent walks (started from nodes drawn at random) sharing the walk length, return times being pooled (always streamed)", "1")
+        self.addIntegerParameter("Nb workers", "Number of processes running the walks (1 runs them within Tulip)", "1")
+        self.addIntegerParameter("Rounds", "Number of rounds the walks are split into, statistics being merged after each round", "10")
+        self.addFloatParameter("Tolerance", "Walks stop early once a round changes the centrality by less than this relative amount (0 never stops early)", "0")
+        self.addIntegerParameter("Exact threshold", "Graphs with up to this number of nodes get their exact centrality (computed by linear algebra, requires scipy) rather than a walk", str(EXACT_THRESHOLD))
+
+    def check(self):
+        if self.graph.numberOfNodes() == 0:
+            return (False, "The graph has no node")
+        if self.dataSet['Walkers'] < 1:
+            return (False, "Walkers must be at least 1")
+        if self.dataSet['Rounds'] < 1:
+            return (False, "Rounds must be at least 1")
+        return (True, "")
+
+    def run(self):
+        seed = self.dataSet['Seed']
+        soc = SecondOrderCentrality(self.graph, None if seed < 0 else seed, self.dataSet['Streaming'])
+        nbSteps = self.dataSet['Walk length'] * self.graph.numberOfEdges()
+        if self.graph.numberOfNodes() <= self.dataSet['Exact threshold']:
+            soc.exactCentrality()
+        elif self.dataSet['Walkers'] > 1:
+            soc.multiWalk(nbSteps, self.dataSet['Walkers'], self.dataSet['Nb workers'], self.dataSet['Rounds'], self.dataSet['Tolerance'])
+        else:
+            soc.randomWalk(nbSteps)
+        soc.writeCentrality(self.result)
+        return True
+
+# The line below does the magic to register the plugin to the plugin database
+# and updates the GUI to make it accessible through the menus.
+tulipplugins.registerPluginOfGroup("SecondOrderCentralityPlugin", "Second Order Centrality (Random Walk)", "Guy Melancon", "18/10/2026", "", "1.0", "Measure")
@@ -0,0 +1,176 @@
+import random
+
+import numpy as np
+import pytest
+from tulip import tlp
+
+from SecondOrderCentrality import (
+    SecondOrderCentrality,
+    ReturnTimeAccumulator,
+    exactReturnTimeStatistics,
+    returnTimeStatistics,
+)
+import SecondOrderCentralityPlugin
+
+
+def cycle_with_chord():
+    G = tlp.newGraph()
+    nodes = G.addNodes(10)
+    for i in range(10):
+        G.addEdge(nodes[i], nodes[(i + 1) % 10])
+    G.addEdge(nodes[0], nodes[5])
+    return G
+
+
+def test_multi_walk_rounds():
+    soc = SecondOrderCentrality(cycle_with_chord(), seed=1)
+    # 11 moves split in rounds of 2 moves: the sixth round ends the walk
+    assert soc.multiWalk(11, 1, 1, 10) == 6
+    assert soc.tick == 11
+    assert soc.multiWalk(1000, 2, 1, 4) == 4
+    assert soc.tick == 1000
+    # remaining moves go to the first walkers
+    assert soc.multiWalk(1001, 3, 1, 4) == 4
+    assert soc.tick == 1001
+    assert [walker.accumulator.tick for walker in soc.walkers] == [334, 334, 333]
+    assert soc.multiWalk(2, 3, 1, 4) == 1
+    assert [walker.accumulator.tick for walker in soc.walkers] == [1, 1, 0]
+    with pytest.raises(ValueError):
+        soc.multiWalk(1000, 2, 1, 0)
+    with pytest.raises(ValueError):
+        soc.multiWalk(1000, 0, 1, 4)
+
+
+def test_plugin_rejects_empty_walks():
+    G = cycle_with_chord()
+    result = G.getDoubleProperty("soc")
+    for parameter in ("Walkers", "Rounds"):
+        params = tlp.getDefaultPluginParameters(
+            "Second Order Centrality (Random Walk)", G
+        )
+        params[parameter] = 0
+        success, message = G.applyDoubleAlgorithm(
+            "Second Order Centrality (Random Walk)", result, params
+        )
+        assert not success and parameter in message
+
+
+def dense_return_time_std(indptr, indices, component):
+    """
+    standard deviation of return times of the jump chain of the Metropolis walk
+    restricted to a component, from its dense fundamental matrix
+    """
+    degree = np.diff(indptr)
+    k = len(component)
+    local = {u: i for i, u in enumerate(component)}
+    P = np.zeros((k, k))
+    for u in component:
+        for v in indices[indptr[u] : indptr[u + 1]]:
+            if v != u:
+                P[local[u], local[v]] += 1.0 / max(degree[u], degree[v])
+    P /= P.sum(axis=1, keepdims=True)
+    values, vectors = np.linalg.eig(P.T)
+    pi = np.real(vectors[:, np.argmin(abs(values - 1))])
+    pi /= pi.sum()
+    Z = np.linalg.inv(np.eye(k) - P + np.outer(np.ones(k), pi))
+    return np.sqrt(2 * np.diag(Z) - pi - 1) / pi
+
+
+def test_exact_return_times():
+    G = tlp.newGraph()
+    nodes = G.addNodes(42)
+    rnd = random.Random(3)
+    for i in range(29):
+        G.addEdge(nodes[i], nodes[i + 1])
+    for i in range(40):
+        G.addEdge(*rnd.sample(nodes[:30], 2))
+    # a loop, a multiple edge, a second component and an isolated node
+    G.addEdge(nodes[3], nodes[3])
+    G.addEdge(nodes[4], nodes[5])
+    for i in range(30, 40):
+        G.addEdge(nodes[i], nodes[i + 1])
+
+    soc = SecondOrderCentrality(G, seed=1)
+    adjacency = soc.snapshot.adjacency
+    positions = soc.snapshot.node_positions(nodes)
+    mean, std = exactReturnTimeStatistics(adjacency.indptr, adjacency.indices)
+    for component in (positions[:30], positions[30:41]):
+        expected = dense_return_time_std(adjacency.indptr, adjacency.indices, component)
+        assert np.allclose(std[component], expected, rtol=1e-9)
+    assert mean[positions[41]] == 0 and std[positions[41]] == 0
+
+    # a long walk within the first component agrees up to sampling noise
+    soc.activeNode = nodes[0]
+    soc.randomWalk(1000000)
+    walked = soc.centrality()[positions[:30]]
+    assert (
+        np.abs(walked - std[positions[:30]]).max() < 0.05 * std[positions[:30]].mean()
+    )
+
+
+def per_node_statistics(trajectories, nb_nodes):
+    """
+    number, mean and standard deviation of the return times of each node,
+    pooled over trajectories, from the differences of its visit ticks
+    """
+    gaps = [[] for v in range(nb_nodes)]
+    for trajectory in trajectories:
+        for v in range(nb_nodes):
+            gaps[v].extend(np.diff(np.flatnonzero(trajectory == v)))
+    count = np.array([len(g) for g in gaps])
+    mean = np.array([np.mean(g) if len(g) > 0 else 0.0 for g in gaps])
+    std = np.array([np.std(g) if len(g) > 0 else 0.0 for g in gaps])
+    return count, mean, std
+
+
+def test_return_time_statistics():
+    # node 3 is visited once, node 4 never
+    trajectory = np.array([0, 1, 0, 2, 1, 1, 3, 0, 2, 0, 1])
+    count, mean, std = returnTimeStatistics(trajectory, 5)
+    assert list(count) == [3, 3, 1, 0, 0]
+    assert np.allclose(mean, [3, 3, 5, 0, 0])
+    assert np.allclose(std, [np.std([2, 5, 2]), np.std([3, 1, 5]), 0, 0, 0])
+    assert_statistics(
+        returnTimeStatistics(trajectory, 5), per_node_statistics([trajectory], 5)
+    )
+
+
+def random_trajectory(seed, length, nb_nodes):
+    # the last node is never visited, the one before is visited once
+    trajectory = np.random.default_rng(seed).integers(nb_nodes - 2, size=length)
+    trajectory[length // 3] = nb_nodes - 2
+    return trajectory
+
+
+def accumulate(trajectory, nb_nodes, bounds):
+    accumulator = ReturnTimeAccumulator(nb_nodes)
+    for chunk in np.split(trajectory, bounds):
+        accumulator.update(chunk)
+    return accumulator
+
+
+def assert_statistics(statistics, expected):
+    count, mean, std = statistics
+    assert list(count) == list(expected[0])
+    assert np.allclose(mean, expected[1]) and np.allclose(std, expected[2])
+
+
+def test_return_time_accumulator():
+    nb_nodes = 8
+    trajectory = random_trajectory(1, 500, nb_nodes)
+    expected = per_node_statistics([trajectory], nb_nodes)
+    # chunks of one tick, chunks where nodes are not visited, ...
+    for bounds in ([], [1, 2, 3], [37, 200, 201, 499], list(range(10, 500, 10))):
+        accumulator = accumulate(trajectory, nb_nodes, bounds)
+        assert accumulator.tick == 500
+        assert_statistics(accumulator.statistics(), expected)
+    # independent walks pool their return times
+    walks = [random_trajectory(seed, 300, nb_nodes) for seed in (2, 3, 4)]
+    merged = ReturnTimeAccumulator.merge(
+        [accumulate(walk, nb_nodes, [100, 250]) for walk in walks]
+    )
+    assert merged.tick == 900
+    assert_statistics(merged.statistics(), per_node_statistics(walks, nb_nodes))
+    single = accumulate(trajectory, nb_nodes, [250])
+    merged = ReturnTimeAccumulator.merge([single])
+    assert_statistics(merged.statistics(), single.statistics())
@@ -1,5 +1,235 @@
 
 from tulip import *
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from GraphSnapshot import GraphSnapshot
+
+# upper bound on the number of (edge, candidate neighbor) pairs checked at once
+_BATCH_CELLS_ = 1 << 22
+
+# state of a worker process computing edge redundancy, set once by _init_worker_
+_worker_ = {}
+
+def common_neighbor_counts(nb_nodes, sources, targets):
+    '''
+    counts, for each edge (given by the positions of its ends), the common neighbors
+    of its ends, edge direction and multiple edges being ignored
+    (loops are ignored as well, and count 0)
+
+    triangles are listed once with the compact forward algorithm: edges are oriented
+    from lower to higher (degree, position) rank, and the triangle (u, v, w) is found
+    from the edge (u, v) by looking forward neighbors w of u up in the forward
+    neighbors of v; each triangle adds one common neighbor to its three edges
+    '''
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    counts = np.zeros(len(sources), dtype=np.int64)
+    proper = sources != targets
+    # distinct node pairs linked by (at least) an edge
+    low = np.minimum(sources[proper], targets[proper])
+    high = np.maximum(sources[proper], targets[proper])
+    pairs, edge_pair = np.unique(low * nb_nodes + high, return_inverse=True)
+    low, high = pairs // nb_nodes, pairs % nb_nodes
+    degree = np.bincount(low, minlength=nb_nodes) + np.bincount(high, minlength=nb_nodes)
+    rank = np.empty(nb_nodes, dtype=np.int64)
+    rank[np.lexsort((np.arange(nb_nodes), degree))] = np.arange(nb_nodes)
+    forward = rank[low] < rank[high]
+    u = np.where(forward, low, high)
+    v = np.where(forward, high, low)
+    # forward CSR adjacency, sorted by (u, v) so that its keys can be searched
+    order = np.lexsort((v, u))
+    u, v = u[order], v[order]
+    keys = u * nb_nodes + v
+    indptr = np.zeros(nb_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=nb_nodes), out=indptr[1:])
+    out_degree = np.diff(indptr)
+    pair_counts = np.zeros(len(pairs), dtype=np.int64)
+    work = np.cumsum(out_degree[u])
+    start = 0
+    while start < len(u):
+        stop = max(start + 1, np.searchsorted(work, work[start] + _BATCH_CELLS_, side='right'))
+        chunk = np.arange(start, min(stop, len(u)))
+        starts = indptr[u[chunk]]
+        lengths = out_degree[u[chunk]]
+        total = lengths.sum()
+        if total > 0:
+            # candidate (u, w) edges, w being a forward neighbor of u
+            candidates = np.arange(total) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+            uv = np.repeat(chunk, lengths)
+            wanted = v[uv] * nb_nodes + v[candidates]
+            vw = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+            found = keys[vw] == wanted
+            for triangle_edges in (uv[found], candidates[found], vw[found]):
+                pair_counts += np.bincount(triangle_edges, minlength=len(keys))
+        start = stop
+    # back from forward edge order to pair order, and to edges
+    pair_counts[order] = pair_counts.copy()
+    counts[proper] = pair_counts[edge_pair.reshape(-1)]
+    return counts
+
+def top_ranked_neighbors(adjacency, strength, max_rank, tie_break=None):
+    '''
+    positions of the nodes at the other end of the max_rank strongest edges of each node,
+    as a (nb_nodes, max_rank) integer matrix padded with -1 for nodes with fewer edges
+
+    adjacency is a CSR adjacency (see GraphSnapshot) and strength an array of edge
+    strengths indexed by edge positions; edges are ranked by decreasing strength,
+    ties being broken by increasing tie_break values (one per adjacency entry, such as
+    GraphSnapshot.incidence_ranks, Tulip's incidence order), or by edge position
+
+    only the max_rank strongest edges of a node are sorted: edges of nodes with at most
+    max_rank edges are sorted all at once, larger neighborhoods first go through
+    a partial selection of their max_rank strongest edges
+    '''
+    nb_nodes = adjacency.nb_nodes
+    ranked = np.full((nb_nodes, max_rank), -1, dtype=np.int64)
+    if max_rank <= 0:
+        return ranked
+    degree = adjacency.degree()
+    entry_strength = np.asarray(strength, dtype=float)[adjacency.edges]
+    owners = adjacency.owners()
+    tie_break = adjacency.edges if tie_break is None else np.asarray(tie_break)
+    small = degree[owners] <= max_rank
+    # all small neighborhoods are ranked by a single sort over their entries
+    entries = np.flatnonzero(small)
+    entries = entries[np.lexsort((tie_break[entries], -entry_strength[entries], owners[entries]))]
+    sorted_owners = owners[entries]
+    ranks = np.arange(len(entries)) - np.searchsorted(sorted_owners, sorted_owners)
+    ranked[sorted_owners, ranks] = adjacency.indices[entries]
+    for i in np.flatnonzero(degree > max_rank):
+        start, stop = adjacency.indptr[i], adjacency.indptr[i + 1]
+        values = entry_strength[start:stop]
+        # strength of the max_rank-th strongest edge, every stronger edge is kept
+        # and ties at that strength are taken in tie_break order
+        bound = -np.partition(-values, max_rank - 1)[max_rank - 1]
+        candidates = np.flatnonzero(values >= bound)
+        candidates = candidates[np.lexsort((tie_break[start + candidates], -values[candidates]))][:max_rank]
+        ranked[i] = adjacency.indices[start + candidates]
+    return ranked
+
+def _prefix_overlaps_(ranked, ego, alter):
+    '''
+    for a batch of edges (positions of their ends), sizes of the k strongest neighbor
+    sets of both ends and of their intersection, for all k (one column per k)
+
+    each row of ranked is walked once: the first rank at which a node enters a prefix
+    (and enters both prefixes, for the intersection) is histogrammed and then
+    accumulated over ranks
+    '''
+    nb_edges, max_rank = len(ego), ranked.shape[1]
+    nb_nodes = len(ranked)
+    rows = np.repeat(np.arange(nb_edges), max_rank)
+    ranks = np.tile(np.arange(max_rank), nb_edges)
+    sizes = []
+    firsts = []
+    for end in (ego, alter):
+        neighbors = ranked[end].reshape(-1)
+        valid = neighbors >= 0
+        # first occurrence (lowest rank) of each neighbor in a row
+        keys, first = np.unique(rows[valid] * nb_nodes + neighbors[valid], return_index=True)
+        first_ranks = ranks[valid][first]
+        cells = np.bincount(keys // nb_nodes * max_rank + first_ranks, minlength=nb_edges * max_rank)
+        sizes.append(np.cumsum(cells.reshape(nb_edges, max_rank), axis=1))
+        firsts.append((keys, first_ranks))
+    (ego_keys, ego_ranks), (alter_keys, alter_ranks) = firsts
+    common, i, j = np.intersect1d(ego_keys, alter_keys, assume_unique=True, return_indices=True)
+    cells = np.bincount(common // nb_nodes * max_rank + np.maximum(ego_ranks[i], alter_ranks[j]), minlength=nb_edges * max_rank)
+    intersection = np.cumsum(cells.reshape(nb_edges, max_rank), axis=1)
+    return sizes[0], sizes[1], intersection
+
+def edge_redundancy(ranked, ego, alter, parametric=False, nb_workers=1):
+    '''
+    redundancy of edges given by the positions of their ends, from the matrix of
+    ranked neighbors of nodes (see top_ranked_neighbors)
+
+    parametric redundancy is the number of common nodes among the strongest neighbors
+    of both ends, non parametric redundancy the maximum over k of the Jaccard index
+    of the k strongest neighbor sets of both ends
+
+    edges are split in chunks processed by a pool of nb_workers processes when
+    nb_workers > 1 (see _parallel_edge_redundancy_)
+    '''
+    ego = np.asarray(ego, dtype=np.int64)
+    alter = np.asarray(alter, dtype=np.int64)
+    in_worker = multiprocessing.current_process().daemon
+    if nb_workers > 1 and not in_worker and len(ego) > 1:
+        return _parallel_edge_redundancy_(ranked, ego, alter, parametric, nb_workers)
+    redundancy = np.zeros(len(ego))
+    batch = max(1, _BATCH_CELLS_ // max(ranked.shape[1], 1))
+    for start in range(0, len(ego), batch):
+        stop = start + batch
+        ego_sizes, alter_sizes, intersection = _prefix_overlaps_(ranked, ego[start:stop], alter[start:stop])
+        if parametric:
+            redundancy[start:stop] = intersection[:, -1]
+            continue
+        union = ego_sizes + alter_sizes - intersection
+        jaccard = np.zeros(union.shape)
+        np.divide(intersection, union, out=jaccard, where=union > 0)
+        redundancy[start:stop] = jaccard.max(axis=1, initial=0.0)
+    return redundancy
+
+def _init_worker_(memory_name, shape, ego, alter, parametric):
+    # the ranked neighbor matrix is read from shared memory, not copied
+    memory = shared_memory.SharedMemory(name=memory_name)
+    _worker_['memory'] = memory
+    _worker_['ranked'] = np.ndarray(shape, dtype=np.int64, buffer=memory.buf)
+    _worker_['ego'] = ego
+    _worker_['alter'] = alter
+    _worker_['parametric'] = parametric
+
+def _chunk_redundancy_(bounds):
+    start, stop = bounds
+    return edge_redundancy(_worker_['ranked'], _worker_['ego'][start:stop], _worker_['alter'][start:stop], _worker_['parametric'])
+
+def _parallel_edge_redundancy_(ranked, ego, alter, parametric, nb_workers):
+    '''
+    computes edge redundancy over chunks of edges in a pool of worker processes,
+    the ranked neighbor matrix being placed once in shared memory (edge ends are shipped
+    once to each worker), chunk results are gathered in edge order
+    '''
+    chunk = -(-len(ego) // (4 * nb_workers))
+    bounds = [(start, min(start + chunk, len(ego))) for start in range(0, len(ego), chunk)]
+    memory = shared_memory.SharedMemory(create=True, size=max(ranked.nbytes, 1))
+    shared = None
+    try:
+        shared = np.ndarray(ranked.shape, dtype=np.int64, buffer=memory.buf)
+        shared[...] = ranked
+        initargs = (memory.name, ranked.shape, ego, alter, parametric)
+        with multiprocessing.Pool(min(nb_workers, len(bounds)), _init_worker_, initargs) as pool:
+            redundancy = np.concatenate(pool.map(_chunk_redundancy_, bounds))
+    finally:
+        # the view must be released before the memory can be closed
+        del shared
+        memory.close()
+        memory.unlink()
+    return redundancy
+
+def redundancy_bounds(redundancy, thresholds):
+    '''
+    minimum redundancy of backbone edges for each threshold: thresholds of at least 1
+    are bounds themselves (parametric case), a threshold x in [0, 1] keeps the x% of
+    edges with highest redundancy, its bound being the redundancy found at rank
+    (1 - x) * m in increasing order (all ranks are selected by a single partition)
+    '''
+    thresholds = np.asarray(thresholds, dtype=float)
+    bounds = thresholds.copy()
+    quantile = thresholds < 1.0
+    if quantile.any() and len(redundancy) > 0:
+        ranks = ((1.0 - thresholds[quantile]) * len(redundancy)).astype(np.int64)
+        ranks = np.minimum(ranks, len(redundancy) - 1)
+        bounds[quantile] = np.partition(redundancy, np.unique(ranks))[ranks]
+    return bounds
+
+def backbone_subgraph(snapshot, mask, name):
+    '''
+    subgraph holding all nodes and the edges flagged in mask (an edge mask in edge
+    position order), built by bulk additions
+    '''
+    sg = snapshot.graph.addSubGraph(name)
+    sg.addNodes(snapshot.nodes)
+    sg.addEdges([snapshot.edges[i] for i in np.flatnonzero(mask)])
+    return sg
 
 class Simmelian(object):
     '''
@@ -9,37 +239,33 @@ class Simmelian(object):
 
     Implements the non parametric version of edge redundancy (see paper for details).
 
-    Uses an optional double property argument (that stores edge strength).
+    Uses an optional double property argument (that stores edge strength),
+    edge redundancy can be computed by a pool of nb_workers processes.
     '''
-    def __init__(self, graph, strength_name_property=None):
+    def __init__(self, graph, strength_name_property=None, nb_workers=1):
         super(Simmelian, self).__init__()
         self.graph = graph
         self.strength_name_property = strength_name_property
-        self.ranked_edges = {}
-        self.rank_edges()
+        self.nb_workers = nb_workers
+        self.snapshot = GraphSnapshot(graph)
+        self.compute_edge_strength()
+        self.ranked_neighbors = None
         self.edge_redundancy = self.graph.getDoubleProperty('edge_redundancy')
 
-    def compute_edge_strength(self, node):
+    def compute_edge_strength(self):
         '''
         computes edge strength, if no double property is assigned
-        edges are those incident to node
-        (edge strength is not defined globally but locally to nodes)
-        (see Bobo Nick's paper for details)
+        (strength of an edge is the number of common neighbors of its ends,
+        see Bobo Nick's paper for details)
         '''
         if self.strength_name_property != None:
             self.edge_strength = self.graph.getDoubleProperty(self.strength_name_property)
             return
         self.strength_name_property = 'edge_strength'
         self.edge_strength = self.graph.getDoubleProperty(self.strength_name_property)
-        for e in self.graph.getInOutEdges(node):
-            ego = self.graph.source(e)
-            alter = self.graph.target(e)
-            ego_neighs = self.graph.getInOutNodes(ego)
-            alter_neighs = self.graph.getInOutNodes(alter)
-
-            mutuals = list(set(ego_neighs) & set(alter_neighs))
-            # strength corresponds to the number of common neighbors
-            self.edge_strength[e] = len(mutuals)
+        # strength corresponds to the number of common neighbors, computed for all edges at once
+        strength = common_neighbor_counts(self.snapshot.nb_nodes, self.snapshot.sources, self.snapshot.targets)
+        self.snapshot.write_edge_values(self.edge_strength, strength)
 
     def edge_compare(self, edge1, edge2):
         '''
@@ -55,11 +281,14 @@ class Simmelian(object):
         else:
             return 0
 
-    def rank_edges(self):
-        for node in self.graph.getNodes():
-            self.compute_edge_strength(node)
-            edges = self.graph.getInOutEdges(node)
-            self.ranked_edges[node] = sorted(edges, cmp=self.edge_compare)
+    def rank_edges(self, max_rank):
+        '''
+        ranks the max_rank strongest edges of each node (see top_ranked_neighbors),
+        ranked_neighbors[i] lists the positions of the corresponding neighbors of the node at position i
+        '''
+        strength = self.snapshot.edge_column(self.edge_strength, dtype=float)
+        # ties are broken in incidence order, as sorting getInOutEdges did
+        self.ranked_neighbors = top_ranked_neighbors(self.snapshot.adjacency, strength, max_rank, self.snapshot.incidence_ranks())
 
     def Jaccard(self, set1, set2):
         return float(len(set1.intersection(set2)))/float(len(set1.union(set2)))
@@ -67,36 +296,24 @@ class Simmelian(object):
     def incident_nodes(self, node, m):
         '''
         computes the set of incident vertices from m strongest ties attached to a node
+        (m cannot exceed the max rank edges were ranked with)
         returns an ordered list of nodes
         '''
-        incident_edges = self.ranked_edges[node][0:m]
-        incident_nodes = []
-        for e in incident_edges:
-            if self.graph.source(e) == node:
-                incident_nodes.append(self.graph.target(e))
-            else:
-                incident_nodes.append(self.graph.source(e))
-        return incident_nodes
+        positions = self.ranked_neighbors[self.snapshot.node_position(node), 0:m]
+        return [self.snapshot.nodes[i] for i in positions if i >= 0]
 
     def compute_edge_redundancy(self, max_rank, parametric=False):
-        for e in self.graph.getEdges():
-            ego = self.graph.source(e)
-            alter = self.graph.target(e)
-
-            ego_ranked_edges = self.ranked_edges[ego]
-            alter_ranked_edges = self.ranked_edges[alter]
-
-            if parametric:
-                s_ego = set(self.incident_nodes(ego, max_rank))
-                s_alter = set(self.incident_nodes(alter, max_rank))
-                r = len(s_ego.intersection(s_alter))
-            else:
-                r = 0.0
-                for k in range(1, max_rank + 1):
-                    s_ego = set(self.incident_nodes(ego, k))
-                    s_alter = set(self.incident_nodes(alter, k))
-                    r = max(r, self.Jaccard(s_ego, s_alter))
-            self.edge_redundancy[e] = r
+        self.rank_edges(max_rank)
+        return self.ranked_edge_redundancy(parametric)
+
+    def ranked_edge_redundancy(self, parametric=False):
+        '''
+        computes edge redundancy from the neighbors ranked by the last call to rank_edges
+        '''
+        # ranked neighbors are walked once per edge, prefix after prefix (see edge_redundancy)
+        redundancy = edge_redundancy(self.ranked_neighbors, self.snapshot.sources, self.snapshot.targets, parametric, self.nb_workers)
+        self.snapshot.write_edge_values(self.edge_redundancy, redundancy)
+        return redundancy
 
     def simmelian_backbone(self, max_rank, redundancy_min_threshold):
         '''
@@ -104,25 +321,35 @@ class Simmelian(object):
         that is redundancy will be computed but only for edges with rank below max_rank
         redundancy threshold x lies in [0, 1], and makes it so that only x% of edges
         are kept as part of the backbone
+        returns the backbone subgraph
         '''
-        parametric = True
-        if redundancy_min_threshold >= 1.0:
-            # parametric case
-            min_redundancy = redundancy_min_threshold
-            self.compute_edge_redundancy(max_rank, True)
-        else:
-            # non parametric, min_threshold in [0, 1]
-            self.compute_edge_redundancy(max_rank, False)
-            redundancy_values = sorted([self.edge_redundancy[e] for e in self.graph.getEdges()])
-            min_redundancy = redundancy_values[int((1.0 - redundancy_min_threshold) * len(redundancy_values))]
-
-        sg = self.graph.addCloneSubGraph()
-        sg.setName('Simmelian_maxrank_' + str(max_rank) + '_redundancymin_' + str(min_redundancy))
-
-        for e in self.graph.getEdges():
-            # On retire les aretes dont le rang est trop eleve et/ou la redondance trop faible
-            if self.edge_redundancy[e] < min_redundancy:
-                sg.delEdge(e)
+        return self.simmelian_backbones(max_rank, [redundancy_min_threshold])[0][1]
+
+    def simmelian_backbones(self, max_rank, redundancy_min_thresholds, build_subgraphs=True):
+        '''
+        computes Simmelian backbones for several redundancy thresholds (parametric
+        and/or non parametric, see simmelian_backbone), redundancy being computed once
+        (per kind of threshold) for all of them, over edges ranked once
+        returns a list of (min redundancy, backbone) pairs, in threshold order,
+        backbones being subgraphs or boolean edge masks (in edge position order)
+        '''
+        thresholds = np.asarray(redundancy_min_thresholds, dtype=float)
+        backbones = [None] * len(thresholds)
+        # ranking does not depend on the kind of threshold
+        self.rank_edges(max_rank)
+        for parametric in (True, False):
+            selected = np.flatnonzero((thresholds >= 1.0) == parametric)
+            if len(selected) == 0:
+                continue
+            redundancy = self.ranked_edge_redundancy(parametric)
+            for i, min_redundancy in zip(selected, redundancy_bounds(redundancy, thresholds[selected])):
+                # edges with a too low redundancy are left out
+                mask = redundancy >= min_redundancy
+                if build_subgraphs:
+                    name = 'Simmelian_maxrank_' + str(max_rank) + '_redundancymin_' + str(min_redundancy)
+                    mask = backbone_subgraph(self.snapshot, mask, name)
+                backbones[i] = (min_redundancy, mask)
+        return backbones
 
 def main(graph):
     #sb = Simmelian(graph, 'edge_strength')
@@ -1,5 +1,8 @@
 from tulip import *
 import tulipplugins
+from GraphSnapshot import GraphSnapshot
+from Simmelian import common_neighbor_counts, top_ranked_neighbors, edge_redundancy, redundancy_bounds, backbone_subgraph
+import numpy as np
 
 class Simmelian_Backbone(tlp.Algorithm):
     '''
@@ -20,19 +23,14 @@ class Simmelian_Backbone(tlp.Algorithm):
         self.addDoublePropertyParameter("Edge strength", "Property from which edge strength is inferred", "viewMetric")
         self.addIntegerParameter("Max rank", "Number of edges used to compute redundancy", "10")
         self.addFloatParameter("Min redundancy", "(Redundancy) Threshold used to filter out edges in graph", "7")
+        self.addStringParameter("Thresholds", "Semicolon separated list of redundancy thresholds (one backbone is built for each of them, Min redundancy is used when empty)", "")
+        self.addIntegerParameter("Nb workers", "Number of processes computing edge redundancy over chunks of edges (1 computes it within Tulip)", "1")
 
     def compute_edge_strength(self):
-        for e in self.graph.getEdges():
-            ego = self.graph.source(e)
-            alter = self.graph.target(e)
-            ego_neighs = self.graph.getInOutNodes(ego)
-            alter_neighs = self.graph.getInOutNodes(alter)
-
-            mutuals = list(set(ego_neighs) & set(alter_neighs))
-            # strength corresponds to the number of common neighbors
-            self.edge_strength[e] = len(mutuals)
-
-            print('Strength edge', e, ':', self.edge_strength[e])
+        # strength corresponds to the number of common neighbors, computed for all edges at once
+        # by counting triangles (see common_neighbor_counts)
+        strength = common_neighbor_counts(self.snapshot.nb_nodes, self.snapshot.sources, self.snapshot.targets)
+        self.snapshot.write_edge_values(self.edge_strength, strength)
 
     def edge_compare(self, edge1, edge2):
         '''
@@ -48,10 +46,11 @@ class Simmelian_Backbone(tlp.Algorithm):
         else:
             return 0
 
-    def rank_edges(self):
-        for node in self.graph.getNodes():
-            edges = self.graph.getInOutEdges(node)
-            self.ranked_edges[node] = sorted(edges, key=lambda x: - self.edge_strength[x]) # cmp=self.edge_compare)
+    def rank_edges(self, max_rank):
+        # only the max_rank strongest edges of each node are ranked (see top_ranked_neighbors),
+        # ties being broken in incidence order, as sorting getInOutEdges did
+        strength = self.snapshot.edge_column(self.edge_strength, dtype=float)
+        self.ranked_neighbors = top_ranked_neighbors(self.snapshot.adjacency, strength, max_rank, self.snapshot.incidence_ranks())
 
     def Jaccard(self, set1, set2):
         return float(len(set1.intersection(set2)))/float(len(set1.union(set2)))
@@ -59,62 +58,46 @@ class Simmelian_Backbone(tlp.Algorithm):
     def incident_nodes(self, node, m):
         '''
         computes the set of incident vertices from m strongest ties attached to a node
+        (m cannot exceed the max rank edges were ranked with)
         returns an ordered list of nodes
         '''
-        incident_edges = self.ranked_edges[node][0:m]
-        incident_nodes = []
-        for e in incident_edges:
-            if self.graph.source(e) == node:
-                incident_nodes.append(self.graph.target(e))
-            else:
-                incident_nodes.append(self.graph.source(e))
-        return incident_nodes
+        positions = self.ranked_neighbors[self.snapshot.node_position(node), 0:m]
+        return [self.snapshot.nodes[i] for i in positions if i >= 0]
 
     def compute_edge_redundancy(self, max_rank, parametric=False):
-        for e in self.graph.getEdges():
-            ego = self.graph.source(e)
-            alter = self.graph.target(e)
-
-            ego_ranked_edges = self.ranked_edges[ego]
-            alter_ranked_edges = self.ranked_edges[alter]
-
-            if parametric:
-                s_ego = set(self.incident_nodes(ego, max_rank))
-                s_alter = set(self.incident_nodes(alter, max_rank))
-                r = len(s_ego.intersection(s_alter))
-            else:
-                r = 0.0
-                for k in range(1, max_rank + 1):
-                    s_ego = set(self.incident_nodes(ego, k))
-                    s_alter = set(self.incident_nodes(alter, k))
-                    r = max(r, self.Jaccard(s_ego, s_alter))
-
-            self.edge_redundancy[e] = r
-
-    def simmelian_backbone(self, max_rank, redundancy_min_threshold):
+        self.rank_edges(max_rank)
+        return self.ranked_edge_redundancy(parametric)
+
+    def ranked_edge_redundancy(self, parametric=False):
+        # redundancy over the neighbors ranked by the last call to rank_edges,
+        # ranked neighbors are walked once per edge, prefix after prefix (see edge_redundancy)
+        redundancy = edge_redundancy(self.ranked_neighbors, self.snapshot.sources, self.snapshot.targets, parametric, self.dataSet['Nb workers'])
+        self.snapshot.write_edge_values(self.edge_redundancy, redundancy)
+        return redundancy
+
+    def simmelian_backbone(self, max_rank, redundancy_min_thresholds):
         '''
         computes the Simmelian backbone according to a maximum rank for edges,
         that is redundancy will be computed but only for edges with rank below max_rank
         redundancy threshold x lies in [0, 1], and makes it so that only x% of edges
         are kept as part of the backbone
-        '''
-        if redundancy_min_threshold >= 1.0:
-            # parametric case
-            min_redundancy = redundancy_min_threshold
-            self.compute_edge_redundancy(max_rank, True)
-        else:
-            # non parametric, min_threshold in [0, 1]
-            self.compute_edge_redundancy(max_rank, False)
-            redundancy_values = sorted([self.edge_redundancy[e] for e in self.graph.getEdges()])
-            min_redundancy = redundancy_values[int((1.0 - redundancy_min_threshold) * len(redundancy_values))]
 
-        sg = self.graph.addCloneSubGraph()
-        sg.setName('Simmelian_maxrank_' + str(max_rank) + '_redundancymin_' + str(min_redundancy))
-
-        for e in self.graph.getEdges():
-            # On retire les aretes dont le rang est trop eleve et/ou la redondance trop faible
-            if self.edge_redundancy[e] < min_redundancy:
-                sg.delEdge(e)
+        a backbone subgraph is built for each threshold of the list, redundancy being
+        computed once (per kind of threshold, parametric or not) for all of them,
+        over edges ranked once
+        '''
+        thresholds = np.asarray(redundancy_min_thresholds, dtype=float)
+        # ranking does not depend on the kind of threshold
+        self.rank_edges(max_rank)
+        for parametric in (True, False):
+            selected = thresholds[(thresholds >= 1.0) == parametric]
+            if len(selected) == 0:
+                continue
+            redundancy = self.ranked_edge_redundancy(parametric)
+            for min_redundancy in redundancy_bounds(redundancy, selected):
+                # edges with a too low redundancy are left out
+                name = 'Simmelian_maxrank_' + str(max_rank) + '_redundancymin_' + str(min_redundancy)
+                backbone_subgraph(self.snapshot, redundancy >= min_redundancy, name)
 
     def check(self):
         # This method is called before applying the algorithm on the input graph.
@@ -139,6 +122,7 @@ class Simmelian_Backbone(tlp.Algorithm):
         # The method must return a boolean indicating if the algorithm
         # has been successfully applied on the input graph.
 
+        self.snapshot = GraphSnapshot(self.graph)
         self.edge_strength = self.dataSet['Edge strength']
         if self.edge_strength.getEdgeMax() == 0.0:
             # non parametric approach
@@ -148,11 +132,12 @@ class Simmelian_Backbone(tlp.Algorithm):
         max_rank = self.dataSet['Max rank']
         min_redundancy = self.dataSet['Min redundancy']
 
-        self.ranked_edges = {}
-        self.rank_edges()
         self.edge_redundancy = self.graph.getDoubleProperty('edge_redundancy')
 
-        self.simmelian_backbone(max_rank, min_redundancy)
+        thresholds = [min_redundancy]
+        if self.dataSet['Thresholds'].strip() != '':
+            thresholds = [float(x) for x in self.dataSet['Thresholds'].split(';') if x.strip() != '']
+        self.simmelian_backbone(max_rank, thresholds)
 
         return True
 
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# the module and the GraphSnapshot module it imports are not packaged
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [
+    os.path.join(here, ".."),
+    os.path.join(here, "..", "..", "GraphSnapshot"),
+]
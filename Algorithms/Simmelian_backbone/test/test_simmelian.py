@@ -0,0 +1,232 @@
+import random
+
+import numpy as np
+from tulip import tlp
+
+from GraphSnapshot import GraphSnapshot
+import Simmelian as simmelian_module
+from Simmelian import (
+    common_neighbor_counts,
+    top_ranked_neighbors,
+    edge_redundancy,
+    redundancy_bounds,
+    Simmelian,
+)
+
+
+def graph_with_deleted_edges(seed):
+    rnd = random.Random(seed)
+    G = tlp.newGraph()
+    nodes = G.addNodes(20)
+    for i in range(80):
+        G.addEdge(*rnd.sample(nodes, 2))
+    for e in rnd.sample(list(G.getEdges()), 20):
+        G.delEdge(e)
+    # new edges get recycled ids, and are appended to incidence lists
+    for i in range(20):
+        G.addEdge(*rnd.sample(nodes, 2))
+    strength = G.getDoubleProperty("strength")
+    for e in G.getEdges():
+        strength[e] = rnd.randint(0, 2)
+    return G, strength
+
+
+def test_incidence_ranks():
+    G, _ = graph_with_deleted_edges(1)
+    snapshot = GraphSnapshot(G)
+    adjacency = snapshot.adjacency
+    ranks = snapshot.incidence_ranks()
+    for i, n in enumerate(snapshot.nodes):
+        entries = range(adjacency.indptr[i], adjacency.indptr[i + 1])
+        ordered = sorted(entries, key=lambda k: ranks[k])
+        edge_ids = [snapshot.edge_ids[adjacency.edges[k]] for k in ordered]
+        assert edge_ids == [e.id for e in G.getInOutEdges(n)]
+
+
+def test_ties_in_incidence_order():
+    max_rank = 4
+    for seed in range(5):
+        G, strength = graph_with_deleted_edges(seed)
+        snapshot = GraphSnapshot(G)
+        ranked = top_ranked_neighbors(
+            snapshot.adjacency,
+            snapshot.edge_column(strength, dtype=float),
+            max_rank,
+            snapshot.incidence_ranks(),
+        )
+        for i, n in enumerate(snapshot.nodes):
+            # stable sort of incident edges by decreasing strength
+            edges = sorted(G.getInOutEdges(n), key=lambda e: -strength[e])[:max_rank]
+            expected = [snapshot.node_position(G.opposite(e, n)) for e in edges]
+            expected += [-1] * (max_rank - len(expected))
+            assert list(ranked[i]) == expected
+
+
+def set_based_common_neighbors(G):
+    """
+    common neighbors of the ends of each edge, a node not being its own neighbor
+    (loops count 0)
+    """
+    neighbors = {n: set(G.getInOutNodes(n)) - {n} for n in G.getNodes()}
+    counts = []
+    for e in G.getEdges():
+        ego, alter = G.ends(e)
+        counts.append(0 if ego == alter else len(neighbors[ego] & neighbors[alter]))
+    return np.array(counts)
+
+
+def test_common_neighbor_counts(monkeypatch):
+    rnd = random.Random(5)
+    loops = tlp.newGraph()
+    nodes = loops.addNodes(30)
+    for i in range(120):
+        loops.addEdge(*rnd.sample(nodes, 2))
+    for n in nodes[:3]:
+        loops.addEdge(n, n)
+    multiple = tlp.newGraph()
+    nodes = multiple.addNodes(30)
+    for i in range(100):
+        u, v = rnd.sample(nodes, 2)
+        multiple.addEdge(u, v)
+        if i % 4 == 0:
+            # multiple edges, in both directions
+            multiple.addEdge(v, u)
+            multiple.addEdge(u, v)
+    for G in (loops, multiple):
+        snapshot = GraphSnapshot(G)
+        counts = common_neighbor_counts(
+            snapshot.nb_nodes, snapshot.sources, snapshot.targets
+        )
+        assert list(counts) == list(set_based_common_neighbors(G))
+        # triangles listed over many small batches
+        monkeypatch.setattr(simmelian_module, "_BATCH_CELLS_", 8)
+        counts = common_neighbor_counts(
+            snapshot.nb_nodes, snapshot.sources, snapshot.targets
+        )
+        assert list(counts) == list(set_based_common_neighbors(G))
+        monkeypatch.undo()
+
+
+def small_multigraph(seed):
+    """
+    graph with multiple edges, a loop and nodes of degree below max rank
+    """
+    rnd = random.Random(seed)
+    G = tlp.newGraph()
+    nodes = G.addNodes(12)
+    for i in range(24):
+        G.addEdge(*rnd.sample(nodes[:9], 2))
+    G.addEdge(nodes[0], nodes[1])
+    G.addEdge(nodes[0], nodes[1])
+    G.addEdge(nodes[2], nodes[2])
+    G.addEdge(nodes[9], nodes[10])
+    G.addEdge(nodes[10], nodes[11])
+    strength = G.getDoubleProperty("strength")
+    for e in G.getEdges():
+        strength[e] = rnd.randint(0, 3)
+    return G, strength
+
+
+def set_based_redundancy(G, strength, max_rank, parametric):
+    """
+    edge redundancy computed from sets of strongest neighbors, one edge at a time
+    """
+    ranked = {
+        n: sorted(G.getInOutEdges(n), key=lambda e: -strength[e]) for n in G.getNodes()
+    }
+
+    def incident_nodes(n, m):
+        return set(G.opposite(e, n) for e in ranked[n][0:m])
+
+    redundancy = []
+    for e in G.getEdges():
+        ego, alter = G.ends(e)
+        if parametric:
+            r = len(incident_nodes(ego, max_rank) & incident_nodes(alter, max_rank))
+        else:
+            r = 0.0
+            for k in range(1, max_rank + 1):
+                s_ego, s_alter = incident_nodes(ego, k), incident_nodes(alter, k)
+                r = max(r, float(len(s_ego & s_alter)) / len(s_ego | s_alter))
+        redundancy.append(r)
+    return np.array(redundancy)
+
+
+def ranked_snapshot(G, strength, max_rank):
+    snapshot = GraphSnapshot(G)
+    ranked = top_ranked_neighbors(
+        snapshot.adjacency,
+        snapshot.edge_column(strength, dtype=float),
+        max_rank,
+        snapshot.incidence_ranks(),
+    )
+    return snapshot, ranked
+
+
+def test_edge_redundancy():
+    for seed in range(5):
+        G, strength = small_multigraph(seed)
+        for max_rank in (1, 3, 6):
+            snapshot, ranked = ranked_snapshot(G, strength, max_rank)
+            for parametric in (True, False):
+                redundancy = edge_redundancy(
+                    ranked, snapshot.sources, snapshot.targets, parametric
+                )
+                expected = set_based_redundancy(G, strength, max_rank, parametric)
+                assert np.allclose(redundancy, expected)
+
+
+def test_parallel_edge_redundancy():
+    G, strength = small_multigraph(7)
+    snapshot, ranked = ranked_snapshot(G, strength, 4)
+    for parametric in (True, False):
+        sequential = edge_redundancy(
+            ranked, snapshot.sources, snapshot.targets, parametric, nb_workers=1
+        )
+        parallel = edge_redundancy(
+            ranked, snapshot.sources, snapshot.targets, parametric, nb_workers=2
+        )
+        assert np.array_equal(parallel, sequential)
+
+
+def sorted_index_bound(redundancy, threshold):
+    """
+    bound of a single threshold, as the baseline took it from sorted redundancy values
+    """
+    if threshold >= 1.0:
+        return threshold
+    values = sorted(redundancy)
+    return values[int((1.0 - threshold) * len(values))]
+
+
+def test_redundancy_bounds():
+    rnd = np.random.default_rng(2)
+    redundancy = rnd.integers(0, 10, 200) / 10.0
+    thresholds = [0.05, 0.5, 3, 0.25, 0.99, 1, 0.5]
+    bounds = redundancy_bounds(redundancy, thresholds)
+    assert list(bounds) == [sorted_index_bound(redundancy, x) for x in thresholds]
+
+
+def test_simmelian_backbones(monkeypatch):
+    G, strength = small_multigraph(3)
+    max_rank = 4
+    thresholds = [0.2, 2, 0.5, 1, 0.8]
+    sb = Simmelian(G, "strength")
+    ranked = []
+    rank_edges = sb.rank_edges
+    monkeypatch.setattr(
+        sb, "rank_edges", lambda m: (ranked.append(m), rank_edges(m))[1]
+    )
+    backbones = sb.simmelian_backbones(max_rank, thresholds, build_subgraphs=False)
+    # edges are ranked once for both kinds of thresholds
+    assert ranked == [max_rank]
+    for x, (min_redundancy, mask) in zip(thresholds, backbones):
+        expected = set_based_redundancy(G, strength, max_rank, x >= 1.0)
+        assert min_redundancy == sorted_index_bound(expected, x)
+        assert list(mask) == list(expected >= min_redundancy)
+    # a single threshold, as a subgraph
+    backbone = sb.simmelian_backbone(max_rank, 0.5)
+    mask = backbones[2][1]
+    assert [e.id for e in backbone.edges()] == [
+        e.id for e, kept in zip(G.edges(), mask) if kept
+    ]